@@ -27,41 +27,34 @@ def formatFigure(fig, axis):
 
 dataDirectory = 'data/'
 plotCircuitList = ['200','201','202','203','205','206','207','208','209','210','211','212']
-circuit = '207'
 dateRangeStart = datetime.datetime(2011, 01, 01)
 dateRangeEnd = datetime.datetime(2011, 02, 1)
-
-# loop through days
-# for each day compute total use and store in array
-days = (dateRangeEnd - dateRangeStart).days
-days = range(days)
-
-for circuit in plotCircuitList:
-    print 'getting data for circuit', circuit
-    data = []
-    for day in days:
-        dateStart = dateRangeStart + datetime.timedelta(days=day)
-        dateEnd = dateStart + datetime.timedelta(days=1)
-
-        tempData = ssp.getFormattedData(circuit, dateStart, dateEnd, 1, dataDirectory)
-
-        if tempData != []:
-            newTime, newData = ssp.resampleData(tempData, 'Watts', dateStart, dateEnd, 10*60)
-        else:
-            print 'no data for', dateStart, circuit
-
-        if newData == []:
-            print 'no data for', dateStart, circuit
-        else:
-            if data == []:
-                data = newData
+# seconds in each time of day bin
+binSeconds = 10*60
+# plot weekdays and weekends separately
+splitWeekend = False
+
+if __name__ == '__main__':
+    # one pass over every circuit's days gives its typical day
+    ssp.verbose = 1
+    profileDict = ssp.getDayProfiles(plotCircuitList, dateRangeStart,
+                                     dateRangeEnd, dataDirectory,
+                                     binSeconds, splitWeekend)
+
+    # plot the bins of the typical day on the first day of the range
+    binTimes = [dateRangeStart + datetime.timedelta(seconds=int(s))
+                for s in profileDict[plotCircuitList[0]].getBinStarts()]
+    mpldays = matplotlib.dates.date2num(binTimes)
+    for circuit in plotCircuitList:
+        profile = profileDict[circuit]
+        for group in profile.groupNames:
+            fig, axis = getFigure()
+            print 'plotting circuit', circuit, group
+            p10, p90 = profile.getQuantile([0.1, 0.9], group)
+            axis.fill_between(mpldays, p10, p90, color=(0.8, 0.8, 0.8))
+            axis.plot_date(mpldays, profile.getMean(group), '-')
+            formatFigure(fig, axis)
+            if splitWeekend:
+                fig.savefig('averaged_' + circuit + '_' + group + '.pdf')
             else:
-                data += newData
-        data /= (dateRangeEnd - dateRangeStart).days
-    # what is time axis now that there are different days being consolidated?
-    mpldays = matplotlib.dates.date2num(newTime)
-    fig, axis = getFigure()
-    print 'plotting circuit', circuit
-    axis.plot_date(mpldays, data,'-')
-    formatFigure(fig, axis)
-    fig.savefig('averaged_'+circuit+'.pdf')
\ No newline at end of file
+                fig.savefig('averaged_' + circuit + '.pdf')
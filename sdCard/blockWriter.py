@@ -0,0 +1,81 @@
+'''
+buffered writer for large text outputs such as the merged csv from
+writeHugeCSV.py
+
+text is collected in memory and handed to the file in large blocks
+instead of one write per field, and the output file is compressed on
+the fly when its name ends in .gz, .bz2, .xz or .lzma
+'''
+
+import bz2
+import gzip
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+
+def openOutput(fileName, append=False):
+    '''
+    open fileName for writing, choosing gzip, bz2 or lzma compression
+    from the file extension and plain text otherwise.  with append the
+    text is added to the end of the file, as a new compressed stream for
+    compressed files.  bz2 files cannot be appended to, as python 2 only
+    reads the first stream of a bz2 file
+    '''
+    if fileName.endswith('.gz'):
+        return gzip.open(fileName, 'ab' if append else 'wb')
+    if fileName.endswith('.bz2'):
+        if append:
+            raise ValueError('cannot append to %s, python 2 reads only the '
+                             'first stream of a bz2 file' % fileName)
+        return bz2.BZ2File(fileName, 'wb')
+    if fileName.endswith('.xz') or fileName.endswith('.lzma'):
+        if lzma is None:
+            raise ValueError('lzma output needs the lzma module '
+                             '(backports.lzma on python 2)')
+        return lzma.LZMAFile(fileName, 'ab' if append else 'wb')
+    return open(fileName, 'a' if append else 'w')
+
+class BlockWriter(object):
+    '''
+    file-like object that buffers written text and passes it on to the
+    underlying file once at least blockSize characters are waiting
+    '''
+    def __init__(self, file, blockSize=1 << 20):
+        self.file = file
+        self.blockSize = blockSize
+        self.buffer = []
+        self.bufferSize = 0
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.bufferSize += len(text)
+        if self.bufferSize >= self.blockSize:
+            self.writeBuffer()
+
+    def writeRows(self, rows):
+        '''
+        write a block of already formatted rows in one call
+        '''
+        self.write(''.join(rows))
+
+    def writeBuffer(self):
+        if self.buffer:
+            self.file.write(''.join(self.buffer))
+            self.buffer = []
+            self.bufferSize = 0
+
+    def flush(self):
+        self.writeBuffer()
+        # python 2 BZ2File has no flush
+        if hasattr(self.file, 'flush'):
+            self.file.flush()
+
+    def close(self):
+        self.writeBuffer()
+        self.file.close()
@@ -0,0 +1,178 @@
+'''
+columnar storage for the merged sd card table
+
+a column store is a directory holding one raw binary file per column,
+an int64 'time' column of epoch seconds and a float32 column for every
+circuit quantity, plus a small columns.json describing them.  missing
+samples are stored as nan.  columns are opened with np.memmap so one
+circuit's watts for a year can be read without touching the rest
+
+    store = columnStore.openColumnStore('20110201120000.columns')
+    watts = store.column('201_watts')
+    dates = store.datetimes()
+'''
+
+import json
+import os
+import shutil
+import numpy as np
+
+metadataFileName = 'columns.json'
+timeDtype = np.dtype('int64')
+valueDtype = np.dtype('float32')
+
+
+def columnFileName(name, dtype):
+    '''
+    file name for a column, e.g. '201_watt hours today' as float32 is
+    stored in '201_watt_hours_today.float32'
+    '''
+    return name.replace(' ', '_') + '.' + np.dtype(dtype).name
+
+class ColumnStoreWriter(object):
+    '''
+    creates a column store in 'directory' and appends blocks of rows to
+    it.  with append, rows are added to an existing store with the same
+    columns instead, after cutting it back to 'rows' rows if given.
+    close() must be called to record the final row count
+    '''
+    def __init__(self, directory, columnNames, append=False, rows=None):
+        self.directory = directory
+        self.columnNames = list(columnNames)
+        if append:
+            metadata = readMetadata(directory)
+            if [c['name'] for c in metadata['columns']] != self.columnNames:
+                raise ValueError('column store %s has different columns' %
+                                 directory)
+            self.rows = metadata['rows']
+            if rows is not None:
+                self.rows = min(rows, self.rows)
+            mode = 'r+b'
+        else:
+            os.makedirs(directory)
+            self.rows = 0
+            mode = 'wb'
+        self.timeFile = self.openColumnFile('time', timeDtype, mode)
+        self.columnFiles = []
+        for name in self.columnNames:
+            self.columnFiles.append(self.openColumnFile(name, valueDtype, mode))
+        self.writeMetadata()
+
+    def openColumnFile(self, name, dtype, mode):
+        file = open(os.path.join(self.directory, columnFileName(name, dtype)),
+                    mode)
+        # drop anything past the recorded rows, left by an interrupted run
+        file.truncate(self.rows * np.dtype(dtype).itemsize)
+        file.seek(0, os.SEEK_END)
+        return file
+
+    def appendRows(self, times, values):
+        '''
+        append epoch second 'times' with shape (n,) and 'values' with
+        shape (number of columns, n)
+        '''
+        times = np.ascontiguousarray(times, dtype=timeDtype)
+        values = np.asarray(values, dtype=valueDtype)
+        if values.shape != (len(self.columnNames), len(times)):
+            raise ValueError('values must have shape (%d, %d)' %
+                             (len(self.columnNames), len(times)))
+        times.tofile(self.timeFile)
+        for i, file in enumerate(self.columnFiles):
+            np.ascontiguousarray(values[i]).tofile(file)
+        self.rows += len(times)
+
+    def appendStore(self, directory):
+        '''
+        append every row of the column store in 'directory', which must
+        have the same columns
+        '''
+        metadata = readMetadata(directory)
+        if [c['name'] for c in metadata['columns']] != self.columnNames:
+            raise ValueError('column store %s has different columns' % directory)
+        self.appendFile(os.path.join(directory, metadata['time']['file']),
+                        self.timeFile)
+        for column, file in zip(metadata['columns'], self.columnFiles):
+            self.appendFile(os.path.join(directory, column['file']), file)
+        self.rows += metadata['rows']
+
+    def appendFile(self, fileName, file):
+        source = open(fileName, 'rb')
+        shutil.copyfileobj(source, file)
+        source.close()
+
+    def writeMetadata(self):
+        metadata = {'rows': self.rows,
+                    'time': {'name': 'time',
+                             'file': columnFileName('time', timeDtype),
+                             'dtype': timeDtype.name},
+                    'columns': [{'name': name,
+                                 'file': columnFileName(name, valueDtype),
+                                 'dtype': valueDtype.name}
+                                for name in self.columnNames]}
+        file = open(os.path.join(self.directory, metadataFileName), 'w')
+        json.dump(metadata, file, indent=1)
+        file.close()
+
+    def flush(self):
+        self.timeFile.flush()
+        for file in self.columnFiles:
+            file.flush()
+        self.writeMetadata()
+
+    def close(self):
+        self.timeFile.close()
+        for file in self.columnFiles:
+            file.close()
+        self.writeMetadata()
+
+def readMetadata(directory):
+    file = open(os.path.join(directory, metadataFileName), 'r')
+    metadata = json.load(file)
+    file.close()
+    return metadata
+
+class ColumnStore(object):
+    '''
+    read only view of a column store directory, see openColumnStore
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        self.metadata = readMetadata(directory)
+        self.rows = self.metadata['rows']
+        self.columns = [c['name'] for c in self.metadata['columns']]
+        self.columnDict = dict((c['name'], c) for c in self.metadata['columns'])
+
+    def mapColumn(self, column):
+        dtype = np.dtype(str(column['dtype']))
+        if self.rows == 0:
+            # np.memmap refuses to map empty files
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(os.path.join(self.directory, column['file']),
+                         dtype=dtype, mode='r', shape=(self.rows,))
+
+    def time(self):
+        '''
+        memory mapped int64 array of epoch seconds
+        '''
+        return self.mapColumn(self.metadata['time'])
+
+    def datetimes(self):
+        '''
+        time column as a datetime64[s] array
+        '''
+        return self.time().astype('datetime64[s]')
+
+    def column(self, name):
+        '''
+        memory mapped float32 array for a column such as '201_watts'
+        '''
+        if name not in self.columnDict:
+            raise KeyError('no column %r in %s' % (name, self.directory))
+        return self.mapColumn(self.columnDict[name])
+
+def openColumnStore(directory):
+    '''
+    open a column store written by writeHugeCSV.py with
+    outputFormat = 'columns'
+    '''
+    return ColumnStore(directory)
@@ -0,0 +1,88 @@
+'''
+energy per interval from cumulative watt hour counters
+
+the meters report energy as counters: 'Watt Hours Today' in the sd card
+logs and 'watthours' on the gateway both start again from zero at
+midnight, and now and then a reading is a little lower than the one
+before it.  counterEnergy turns a counter series into the energy used in
+each interval between edges in one vectorized pass:
+
+  - a decrease across midnight, or one larger than resetTolerance, is a
+    reset, and the reading after it is energy used since the reset
+  - a smaller decrease is a rollback, and no energy is counted until the
+    counter climbs back above its earlier high
+  - the energy of each step is spread evenly over the time between its
+    two samples (from midnight for a midnight reset) and split at the
+    interval edges
+
+times are seconds since 1970, see datetimesToSeconds
+
+    energy = counterEnergy.counterEnergy(seconds, watthours, edges)
+'''
+
+import calendar
+import numpy as np
+
+
+def datetimesToSeconds(dates):
+    '''
+    int64 array of seconds since 1970 for a list of datetimes
+    '''
+    return np.array([calendar.timegm(d.timetuple()) for d in dates],
+                    dtype=np.int64)
+
+def classifySteps(seconds, counter, resetTolerance=5.0, resetAtMidnight=True):
+    '''
+    for the steps between consecutive samples, returns the energy of
+    each step, masks of the steps that are resets and rollbacks, and
+    the counter's running high since the last reset at each sample,
+    which is the value to continue from in a following chunk
+    '''
+    seconds = np.asarray(seconds, dtype=np.int64)
+    counter = np.asarray(counter, dtype=float)
+    if len(counter) < 2:
+        empty = np.zeros(0, dtype=bool)
+        return np.zeros(0), empty, empty, counter
+    step = np.diff(counter)
+    decrease = step < 0
+    reset = decrease & (-step > resetTolerance)
+    if resetAtMidnight:
+        newDay = seconds[1:] // 86400 > seconds[:-1] // 86400
+        reset |= decrease & newDay
+    rollback = decrease & ~reset
+    # running high of the counter since the last reset, offsetting each
+    # reset segment above the last so one accumulate covers all of them
+    segment = np.concatenate(([0], np.cumsum(reset)))
+    offset = segment * (counter.max() - counter.min() + 1.0)
+    high = np.maximum.accumulate(counter + offset) - offset
+    stepEnergy = np.diff(high)
+    stepEnergy[reset] = np.maximum(counter[1:][reset], 0)
+    return stepEnergy, reset, rollback, high
+
+def counterEnergy(seconds, counter, edges, resetTolerance=5.0,
+                  resetAtMidnight=True):
+    '''
+    energy in the counter's units (watt hours) used in each interval
+    between consecutive edges (seconds since 1970), from samples of a
+    cumulative counter in time order.  energy outside the first and last
+    samples is not known and is not counted
+    '''
+    seconds = np.asarray(seconds, dtype=np.int64)
+    edges = np.asarray(edges, dtype=np.int64)
+    stepEnergy, reset, rollback, high = classifySteps(seconds, counter,
+                                                      resetTolerance,
+                                                      resetAtMidnight)
+    if len(stepEnergy) == 0:
+        return np.zeros(len(edges) - 1)
+    # cumulative energy at each sample, linear in time between them
+    times = seconds.astype(float)
+    cumulative = np.concatenate(([0], np.cumsum(stepEnergy)))
+    if resetAtMidnight:
+        # energy after a midnight reset was used after midnight, so hold
+        # the total flat until then
+        newDay = reset & (seconds[1:] // 86400 > seconds[:-1] // 86400)
+        index = np.flatnonzero(newDay)
+        midnight = (seconds[1:][newDay] // 86400) * 86400
+        times = np.insert(times, index + 1, midnight)
+        cumulative = np.insert(cumulative, index + 1, cumulative[index])
+    return np.diff(np.interp(edges, times, cumulative))
@@ -0,0 +1,141 @@
+'''
+typical day profiles of power
+
+a DayProfile takes one day at a time of per time-of-day bin values (such
+as the mean watts in each 10 minute bin from ss_plotting.aggregateData)
+and keeps, for every bin, the running mean and variance across days and
+a powerHistogram.PowerHistogram of the values for the 10th, 50th and
+90th percentiles.  memory depends only on the number of bins, not on the
+number of days, and profiles of separate ranges merge exactly.  days can
+be kept apart as weekdays and weekends
+
+    profile = dayProfile.DayProfile(600, splitWeekend=True)
+    for day, values in days:
+        profile.addDay(day, values)
+    mean = profile.getMean('weekday')
+    p10, p50, p90 = profile.getQuantile([0.1, 0.5, 0.9], 'weekday')
+'''
+
+import numpy as np
+import powerHistogram
+
+
+class DayProfile(object):
+    '''
+    statistics across days for each of the 86400 / binSeconds bins of a
+    day.  the histograms have bins valueBinWidth wide from minValue to
+    maxValue, and count values outside that as under or overflow
+    '''
+    def __init__(self, binSeconds=600, splitWeekend=False, maxValue=500,
+                 valueBinWidth=1, minValue=0):
+        if 86400 % binSeconds != 0:
+            raise ValueError('binSeconds must divide a day')
+        self.binSeconds = binSeconds
+        self.numBins = 86400 // binSeconds
+        self.splitWeekend = splitWeekend
+        if splitWeekend:
+            self.groupNames = ['weekday', 'weekend']
+        else:
+            self.groupNames = ['all']
+        shape = (len(self.groupNames), self.numBins)
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.mean = np.zeros(shape)
+        # sum of squared differences from the mean, for the variance
+        self.m2 = np.zeros(shape)
+        self.histograms = [[powerHistogram.linearHistogram(maxValue,
+                                                           valueBinWidth,
+                                                           minValue)
+                            for b in range(self.numBins)]
+                           for group in self.groupNames]
+        self.days = np.zeros(len(self.groupNames), dtype=np.int64)
+
+    def getGroup(self, day):
+        if not self.splitWeekend:
+            return 0
+        return 1 if day.weekday() >= 5 else 0
+
+    def getGroupIndex(self, group):
+        if group is None:
+            group = self.groupNames[0]
+        return self.groupNames.index(group)
+
+    def addDay(self, day, values):
+        '''
+        add one day of numBins values, with nan for bins without data
+        '''
+        values = np.asarray(values, dtype=float)
+        if values.shape != (self.numBins,):
+            raise ValueError('values must have %d bins' % self.numBins)
+        group = self.getGroup(day)
+        valid = ~np.isnan(values)
+        if not valid.any():
+            return
+        self.days[group] += 1
+        # welford's update for each bin that has a value today
+        count = self.count[group]
+        mean = self.mean[group]
+        count[valid] += 1
+        delta = values[valid] - mean[valid]
+        mean[valid] += delta / count[valid]
+        self.m2[group][valid] += delta * (values[valid] - mean[valid])
+        for b in np.flatnonzero(valid):
+            self.histograms[group][b].add(values[b:b + 1])
+
+    def merge(self, other):
+        '''
+        add the days of another profile with the same bins
+        '''
+        if (self.binSeconds != other.binSeconds or
+            self.groupNames != other.groupNames):
+            raise ValueError('profiles have different bins')
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weight = np.where(count > 0, other.count / count.astype(float), 0)
+        self.mean = self.mean + delta * weight
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * weight
+        self.count = count
+        # raises ValueError for histograms with different bins
+        for histograms, otherHistograms in zip(self.histograms,
+                                               other.histograms):
+            for histogram, otherHistogram in zip(histograms, otherHistograms):
+                histogram.merge(otherHistogram)
+        self.days = self.days + other.days
+        return self
+
+    def getBinStarts(self):
+        '''
+        seconds after midnight at the start of each bin
+        '''
+        return np.arange(self.numBins) * self.binSeconds
+
+    def getMean(self, group=None):
+        i = self.getGroupIndex(group)
+        return np.where(self.count[i] > 0, self.mean[i], np.nan)
+
+    def getVariance(self, group=None):
+        '''
+        sample variance across days of each bin, nan with fewer than two
+        days
+        '''
+        i = self.getGroupIndex(group)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count[i] > 1,
+                            self.m2[i] / (self.count[i] - 1), np.nan)
+
+    def getStd(self, group=None):
+        return np.sqrt(self.getVariance(group))
+
+    def getQuantile(self, q, group=None):
+        '''
+        list of arrays, one for each of the quantiles q, with the value
+        of each bin below which that fraction of days fall, see
+        PowerHistogram.quantile
+        '''
+        i = self.getGroupIndex(group)
+        q = np.atleast_1d(q)
+        values = np.full((len(q), self.numBins), np.nan)
+        for b, histogram in enumerate(self.histograms[i]):
+            if histogram.count > 0:
+                values[:, b] = histogram.quantile(q)
+        return list(values)
@@ -0,0 +1,196 @@
+'''
+materialized (hour, circuit) usage rollup
+
+the rollup keeps, for every hour and circuit, the watt hours used, the
+mean and peak watts and the number of samples, so hourly questions can be
+answered without reading the per second logs again.  it is stored as one
+.npz file along with the size and mtime of the log file each cell was
+computed from, so only new or changed hours need to be summarized when
+the logs grow.  ss_plotting.updateHourlyRollup fills it in
+
+    rollup = hourlyRollup.loadRollup('hourlyRollup.npz', circuitList)
+    energy = rollup.getQuantity('energy', start, end)
+'''
+
+import datetime
+import os
+import numpy as np
+import timeStamps
+
+quantityList = ['energy', 'meanWatts', 'peakWatts', 'count']
+csvColumnNames = {'energy': 'watt_hours',
+                  'meanWatts': 'mean_watts',
+                  'peakWatts': 'peak_watts',
+                  'count': 'samples'}
+
+
+class HourlyRollup(object):
+    '''
+    (hour, circuit) arrays of usage.  hours is a sorted int64 array of
+    the epoch seconds starting each hour.  cells with no samples have a
+    count of 0 and nan for the other quantities
+    '''
+    def __init__(self, fileName, circuitList):
+        self.fileName = fileName
+        self.circuitList = list(circuitList)
+        self.hours = np.zeros(0, dtype=np.int64)
+        self.energy = np.zeros((0, len(self.circuitList)))
+        self.meanWatts = np.zeros((0, len(self.circuitList)))
+        self.peakWatts = np.zeros((0, len(self.circuitList)))
+        self.count = np.zeros((0, len(self.circuitList)), dtype=np.int64)
+        # size and mtime of the log each cell came from, -1 if none
+        self.sourceSize = np.zeros((0, len(self.circuitList)), dtype=np.int64)
+        self.sourceMtime = np.zeros((0, len(self.circuitList)))
+        self.modified = False
+
+    def load(self):
+        archive = np.load(self.fileName)
+        circuitList = [str(c) for c in archive['circuits']]
+        if circuitList != self.circuitList:
+            raise ValueError('rollup %s has circuits %s' %
+                             (self.fileName, ','.join(circuitList)))
+        for name in ['hours', 'sourceSize', 'sourceMtime'] + quantityList:
+            setattr(self, name, archive[name])
+        archive.close()
+
+    def save(self):
+        # write to a temporary file first so readers never see half a file
+        temporaryFileName = self.fileName + '.tmp'
+        file = open(temporaryFileName, 'wb')
+        np.savez(file, circuits=np.array(self.circuitList), hours=self.hours,
+                 sourceSize=self.sourceSize, sourceMtime=self.sourceMtime,
+                 energy=self.energy, meanWatts=self.meanWatts,
+                 peakWatts=self.peakWatts, count=self.count)
+        file.close()
+        os.rename(temporaryFileName, self.fileName)
+        self.modified = False
+
+    def addHours(self, hourList):
+        '''
+        add empty rows for the hour datetimes of hourList that are new,
+        reallocating the arrays once however many there are
+        '''
+        newHours = np.array([timeStamps.datetimeToEpoch(h) for h in hourList],
+                            dtype=np.int64)
+        hours = np.union1d(self.hours, newHours)
+        if len(hours) == len(self.hours):
+            return
+        # rows of the old hours in the new arrays
+        rows = np.searchsorted(hours, self.hours)
+        shape = (len(hours), len(self.circuitList))
+        for name, fill in [('sourceSize', -1), ('sourceMtime', -1),
+                           ('count', 0), ('energy', np.nan),
+                           ('meanWatts', np.nan), ('peakWatts', np.nan)]:
+            old = getattr(self, name)
+            new = np.empty(shape, dtype=old.dtype)
+            new.fill(fill)
+            new[rows] = old
+            setattr(self, name, new)
+        self.hours = hours
+        self.modified = True
+
+    def getHourIndex(self, hour):
+        '''
+        row of an hour datetime, adding an empty row if it is new.  use
+        addHours first when adding many hours
+        '''
+        hourEpoch = timeStamps.datetimeToEpoch(hour)
+        i = np.searchsorted(self.hours, hourEpoch)
+        if i < len(self.hours) and self.hours[i] == hourEpoch:
+            return i
+        self.hours = np.insert(self.hours, i, hourEpoch)
+        self.sourceSize = np.insert(self.sourceSize, i, -1, axis=0)
+        self.sourceMtime = np.insert(self.sourceMtime, i, -1, axis=0)
+        self.count = np.insert(self.count, i, 0, axis=0)
+        for name in ['energy', 'meanWatts', 'peakWatts']:
+            setattr(self, name, np.insert(getattr(self, name), i, np.nan,
+                                          axis=0))
+        self.modified = True
+        return i
+
+    def isCurrent(self, hour, circuit, size, mtime):
+        '''
+        True if the cell was computed from a log with this size and mtime
+        '''
+        hourEpoch = timeStamps.datetimeToEpoch(hour)
+        i = np.searchsorted(self.hours, hourEpoch)
+        if i == len(self.hours) or self.hours[i] != hourEpoch:
+            return False
+        j = self.circuitList.index(circuit)
+        return self.sourceSize[i, j] == size and self.sourceMtime[i, j] == mtime
+
+    def setCell(self, hour, circuit, size, mtime, energy, meanWatts,
+                peakWatts, count):
+        i = self.getHourIndex(hour)
+        j = self.circuitList.index(circuit)
+        self.sourceSize[i, j] = size
+        self.sourceMtime[i, j] = mtime
+        self.energy[i, j] = energy
+        self.meanWatts[i, j] = meanWatts
+        self.peakWatts[i, j] = peakWatts
+        self.count[i, j] = count
+        self.modified = True
+
+    def clearCell(self, hour, circuit):
+        self.setCell(hour, circuit, -1, -1, np.nan, np.nan, np.nan, 0)
+
+    def getRange(self, start=None, end=None):
+        '''
+        slice of the rows from start up to end
+        '''
+        first = 0
+        last = len(self.hours)
+        if start is not None:
+            first = np.searchsorted(self.hours,
+                                    timeStamps.datetimeToEpoch(start))
+        if end is not None:
+            last = np.searchsorted(self.hours, timeStamps.datetimeToEpoch(end))
+        return slice(first, last)
+
+    def getQuantity(self, quantity, start=None, end=None):
+        '''
+        (hour, circuit) array of one of quantityList from start up to end
+        '''
+        return getattr(self, quantity)[self.getRange(start, end)]
+
+    def getHours(self, start=None, end=None):
+        '''
+        datetime64[s] array of the hours from start up to end
+        '''
+        return self.hours[self.getRange(start, end)].astype('datetime64[s]')
+
+    def writeCSV(self, fileName, start=None, end=None, quantities=['energy']):
+        '''
+        write the hours from start up to end with a column for each
+        circuit and quantity, leaving cells with no samples empty
+        '''
+        rows = self.getRange(start, end)
+        file = open(fileName, 'w')
+        header = ['hour']
+        for circuit in self.circuitList:
+            for quantity in quantities:
+                header.append(circuit + '_' + csvColumnNames[quantity])
+        file.write(','.join(header) + '\n')
+        for i in range(rows.start, rows.stop):
+            hour = datetime.datetime.utcfromtimestamp(self.hours[i])
+            line = [hour.strftime('%Y%m%d%H%M%S')]
+            for j in range(len(self.circuitList)):
+                for quantity in quantities:
+                    if self.count[i, j] == 0:
+                        line.append('')
+                    elif quantity == 'count':
+                        line.append(str(self.count[i, j]))
+                    else:
+                        line.append('%.3f' % getattr(self, quantity)[i, j])
+            file.write(','.join(line) + '\n')
+        file.close()
+
+def loadRollup(fileName, circuitList):
+    '''
+    load the rollup saved in fileName, or start an empty one if there is
+    none yet
+    '''
+    rollup = HourlyRollup(fileName, circuitList)
+    if os.path.isfile(fileName):
+        rollup.load()
+    return rollup
@@ -0,0 +1,296 @@
+'''
+cached index of the sd card log directory tree
+
+the logs live in YYYY/MM/DD/HH/ directories with one 192_168_1_XXX.log
+file per circuit.  checking for every circuit file in every hour with
+os.path.isfile is slow on a synced share, so the manifest lists which
+circuit files exist in each hour along with their size, mtime and the
+first and last time stamps in the file.  it is saved as json next to the
+logs and refreshed incrementally: the year, month and day directories
+are listed to find the hour directories, but hour directories whose
+mtime has not changed are not listed again, except for the newest hour,
+whose files may still be growing
+
+    manifest = logManifest.loadManifest('data/')
+    for hour in manifest.getHours(start, end, '192_168_1_201.log'):
+        ...
+'''
+
+import bisect
+import datetime
+import json
+import os
+import stat
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+manifestVersion = 1
+defaultManifestFileName = '.logManifest.json'
+
+
+def listEntries(path):
+    '''
+    returns a list of (name, isDirectory, stat result) for the entries
+    of a directory, using scandir where it is available
+    '''
+    entries = []
+    if scandir is not None:
+        for entry in scandir(path):
+            entries.append((entry.name, entry.is_dir(), entry.stat()))
+        return entries
+    for name in os.listdir(path):
+        entryStat = os.stat(os.path.join(path, name))
+        entries.append((name, stat.S_ISDIR(entryStat.st_mode), entryStat))
+    return entries
+
+def getHourKey(hour):
+    '''
+    manifest key such as '2011/01/31/23' for a datetime
+    '''
+    return '%04d/%02d/%02d/%02d' % (hour.year, hour.month, hour.day, hour.hour)
+
+def parseHourKey(key):
+    year, month, day, hour = map(int, key.split('/'))
+    return datetime.datetime(year, month, day, hour)
+
+def readFirstLastTimeStamps(fileName, size=None):
+    '''
+    returns the time stamp strings of the first and last data lines of
+    a log file, or (None, None) if it only has a header
+    '''
+    file = open(fileName, 'rb')
+    try:
+        # discard header line
+        file.readline()
+        first = file.readline()
+        if len(first) < 14:
+            return None, None
+        last = readLastDataLine(file, size)
+        return first[0:14], last[0:14]
+    finally:
+        file.close()
+
+def readLastDataLine(file, size=None, blockSize=4096):
+    '''
+    returns the last line of an open log file that starts with a 14
+    digit time stamp, reading backwards from the end of the file in
+    blocks, or None if there is no such line
+    '''
+    for line in iterDataLinesBackwards(file, size, blockSize):
+        return line
+    return None
+
+def iterDataLinesBackwards(file, size=None, blockSize=4096):
+    '''
+    generator of the lines of an open log file that start with a 14
+    digit time stamp, last line first, reading backwards from the end
+    of the file (or from size) in blocks
+    '''
+    if size is None:
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+    end = size
+    tail = ''
+    while end > 0:
+        start = max(0, end - blockSize)
+        file.seek(start)
+        tail = file.read(end - start) + tail
+        end = start
+        lines = tail.split('\n')
+        # the first piece may be a partial line unless we hit the start
+        if end > 0:
+            tail = lines[0]
+            lines = lines[1:]
+        else:
+            tail = ''
+        for line in reversed(lines):
+            if len(line) >= 14 and line[0:14].isdigit():
+                yield line
+
+class LogManifest(object):
+    '''
+    index of the circuit log files in a data directory, see loadManifest
+    '''
+    def __init__(self, directory, manifestFileName=None):
+        self.directory = directory
+        if manifestFileName is None:
+            manifestFileName = os.path.join(directory, defaultManifestFileName)
+        self.manifestFileName = manifestFileName
+        # hour key to hour directory mtime
+        self.directoryDict = {}
+        # hour key to {file name: [size, mtime, first, last]}
+        self.hourDict = {}
+        # set when the manifest differs from the saved file
+        self.modified = False
+        # sorted hour keys, rebuilt after a refresh
+        self.hourKeys = None
+
+    def load(self):
+        file = open(self.manifestFileName, 'r')
+        manifest = json.load(file)
+        file.close()
+        if manifest.get('version') != manifestVersion:
+            return
+        self.directoryDict = manifest['directories']
+        self.hourDict = manifest['hours']
+        self.hourKeys = None
+
+    def save(self):
+        manifest = {'version': manifestVersion,
+                    'directories': self.directoryDict,
+                    'hours': self.hourDict}
+        # write to a temporary file first so readers never see half a file
+        temporaryFileName = self.manifestFileName + '.tmp'
+        file = open(temporaryFileName, 'w')
+        json.dump(manifest, file)
+        file.close()
+        os.rename(temporaryFileName, self.manifestFileName)
+        self.modified = False
+
+    def refresh(self, full=False):
+        '''
+        bring the manifest up to date with the directory tree, listing
+        only directories whose mtime changed unless full is True.
+        returns the list of hour keys that were added or changed
+        '''
+        changedHours = []
+        seenHours = set()
+        newestHour = max(self.hourDict.keys()) if self.hourDict else None
+        self.refreshDirectory('', 0, full, newestHour, seenHours, changedHours)
+        # forget hours whose directories disappeared
+        for key in self.hourDict.keys():
+            if key not in seenHours:
+                del self.hourDict[key]
+                self.directoryDict.pop(key, None)
+                self.modified = True
+        if changedHours:
+            self.modified = True
+        self.hourKeys = None
+        return sorted(changedHours)
+
+    def refreshDirectory(self, key, depth, full, newestHour, seenHours,
+                         changedHours):
+        path = os.path.join(self.directory, key)
+        for name, isDirectory, entryStat in listEntries(path):
+            if not isDirectory or not name.isdigit():
+                continue
+            childKey = name if key == '' else key + '/' + name
+            if depth < 3:
+                self.refreshDirectory(childKey, depth + 1, full, newestHour,
+                                      seenHours, changedHours)
+                continue
+            seenHours.add(childKey)
+            # files were only added or removed if the mtime changed
+            unchanged = (not full and
+                         self.directoryDict.get(childKey) == entryStat.st_mtime)
+            if not unchanged:
+                self.directoryDict[childKey] = entryStat.st_mtime
+                self.modified = True
+            if (unchanged and childKey in self.hourDict and
+                childKey != newestHour):
+                continue
+            if self.refreshHour(childKey):
+                changedHours.append(childKey)
+
+    def refreshHour(self, key):
+        '''
+        list one hour directory, re-reading time stamps only for files
+        whose size or mtime changed.  returns True if anything changed
+        '''
+        path = os.path.join(self.directory, key)
+        oldFiles = self.hourDict.get(key, {})
+        files = {}
+        for name, isDirectory, entryStat in listEntries(path):
+            if isDirectory or not name.endswith('.log'):
+                continue
+            old = oldFiles.get(name)
+            if (old is not None and old[0] == entryStat.st_size and
+                old[1] == entryStat.st_mtime):
+                files[name] = old
+                continue
+            first, last = readFirstLastTimeStamps(os.path.join(path, name),
+                                                  entryStat.st_size)
+            files[name] = [entryStat.st_size, entryStat.st_mtime, first, last]
+        self.hourDict[key] = files
+        return files != oldFiles
+
+    def getHours(self, start, end, circuits=None):
+        '''
+        sorted list of hour datetimes from start up to end that have a
+        log file for any of 'circuits' (file names, default any circuit)
+        with samples overlapping the range
+        '''
+        if isinstance(circuits, basestring):
+            circuits = [circuits]
+        if self.hourKeys is None:
+            self.hourKeys = sorted(self.hourDict.keys())
+        # keys sort in time order, so find the range by bisection
+        first = bisect.bisect_left(self.hourKeys, getHourKey(start))
+        last = bisect.bisect_left(self.hourKeys, getHourKey(end))
+        if end != end.replace(minute=0, second=0, microsecond=0):
+            # end falls inside an hour, which is then part of the range
+            last = bisect.bisect_right(self.hourKeys, getHourKey(end))
+        hours = []
+        for key in self.hourKeys[first:last]:
+            hour = parseHourKey(key)
+            if self.getFiles(hour, circuits, start, end):
+                hours.append(hour)
+        return hours
+
+    def getFiles(self, hour, circuits=None, start=None, end=None):
+        '''
+        list of circuit file names present in an hour, limited to
+        'circuits' and to files whose samples overlap start to end
+        '''
+        files = self.hourDict.get(getHourKey(hour), {})
+        startStamp = start.strftime('%Y%m%d%H%M%S') if start else None
+        endStamp = end.strftime('%Y%m%d%H%M%S') if end else None
+        fileList = []
+        for name in sorted(files.keys()):
+            if circuits is not None and name not in circuits:
+                continue
+            size, mtime, first, last = files[name]
+            if first is None:
+                continue
+            if startStamp is not None and last < startStamp:
+                continue
+            if endStamp is not None and first >= endStamp:
+                continue
+            fileList.append(name)
+        return fileList
+
+    def getFileInfo(self, hour, circuit):
+        '''
+        [size, mtime, first, last] for a circuit file in an hour or None
+        '''
+        return self.hourDict.get(getHourKey(hour), {}).get(circuit)
+
+def buildManifest(directory, manifestFileName=None):
+    '''
+    scan the whole data directory tree and save a new manifest
+    '''
+    manifest = LogManifest(directory, manifestFileName)
+    manifest.refresh(full=True)
+    manifest.save()
+    return manifest
+
+def loadManifest(directory, manifestFileName=None, refresh=True):
+    '''
+    load the saved manifest for a data directory, building it if there
+    is none, and bring it up to date unless refresh is False
+    '''
+    manifest = LogManifest(directory, manifestFileName)
+    if not os.path.isfile(manifest.manifestFileName):
+        return buildManifest(directory, manifestFileName)
+    manifest.load()
+    if refresh:
+        manifest.refresh()
+        if manifest.modified:
+            manifest.save()
+    return manifest
@@ -0,0 +1,128 @@
+'''
+memory mapped reader for one hourly sd card log file
+
+the file is mapped once, an index of line start offsets and parsed time
+stamps is built with numpy, and lines are then read by index.  finding
+the first sample at or after a time is a binary search over the index
+
+    reader = logReader.HourlyLogReader('data/2011/01/01/00/192_168_1_201.log')
+    try:
+        for epoch, line in reader.iterUniqueSamples(start, end):
+            ...
+    finally:
+        reader.close()
+'''
+
+import mmap
+import os
+import numpy as np
+import timeStamps
+
+
+class HourlyLogReader(object):
+    '''
+    indexed reader over a log file.  timeStamps holds the epoch seconds
+    of every data line (lines that start with a 14 digit time stamp), in
+    file order, and offsets their (start, end) byte positions
+    '''
+    def __init__(self, fileName, content=None):
+        '''
+        maps fileName, or indexes content, the file already read into a
+        string (see prefetch.FilePrefetcher), without opening the file
+        '''
+        self.fileName = fileName
+        self.file = None
+        self.map = None
+        if content is not None:
+            size = len(content)
+            if size > 0:
+                self.map = content
+        else:
+            self.file = open(fileName, 'rb')
+            size = os.fstat(self.file.fileno()).st_size
+            if size > 0:
+                self.map = mmap.mmap(self.file.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+        self.buildIndex(size)
+
+    def buildIndex(self, size):
+        if self.map is None:
+            self.starts = np.zeros(0, dtype=np.int64)
+            self.ends = np.zeros(0, dtype=np.int64)
+            self.timeStamps = np.zeros(0, dtype=np.int64)
+            return
+        data = np.frombuffer(self.map, dtype=np.uint8)
+        newlines = np.flatnonzero(data == ord('\n'))
+        starts = np.concatenate(([0], newlines + 1)).astype(np.int64)
+        ends = np.concatenate((newlines, [size])).astype(np.int64)
+        # discard header line and anything too short to hold a time stamp
+        starts = starts[1:]
+        ends = ends[1:]
+        keep = ends - starts >= 14
+        starts = starts[keep]
+        ends = ends[keep]
+        stamps = data[starts[:, np.newaxis] + np.arange(14)]
+        keep = ((stamps >= ord('0')) & (stamps <= ord('9'))).all(axis=1)
+        self.starts = starts[keep]
+        self.ends = ends[keep]
+        stamps = np.ascontiguousarray(stamps[keep]).view('S14').reshape(-1)
+        self.timeStamps = timeStamps.timeStampArrayToEpoch(stamps)
+        # drop numpy views of the map so it can be closed
+        del data, stamps
+
+    def __len__(self):
+        return len(self.timeStamps)
+
+    def getLine(self, i):
+        '''
+        text of data line i without its line ending
+        '''
+        return self.map[int(self.starts[i]):int(self.ends[i])].rstrip('\r')
+
+    def getUniqueIndex(self):
+        '''
+        indices of the lines whose time stamp is later than every line
+        before them, so repeated samples are dropped.  their time stamps
+        are strictly increasing
+        '''
+        if len(self.timeStamps) == 0:
+            return np.zeros(0, dtype=np.int64)
+        previousMax = np.maximum.accumulate(self.timeStamps)
+        keep = np.ones(len(self.timeStamps), dtype=bool)
+        keep[1:] = self.timeStamps[1:] > previousMax[:-1]
+        return np.flatnonzero(keep)
+
+    def seek(self, epoch, index=None):
+        '''
+        position in index (all lines by default, which must then be in
+        time order) of the first line at or after epoch seconds, found by
+        binary search
+        '''
+        if index is None:
+            return np.searchsorted(self.timeStamps, epoch, 'left')
+        return np.searchsorted(self.timeStamps[index], epoch, 'left')
+
+    def iterUniqueSamples(self, start=None, end=None):
+        '''
+        generator of (epoch, line) for the unique samples from epoch
+        seconds start up to end
+        '''
+        index = self.getUniqueIndex()
+        first = 0 if start is None else self.seek(start, index)
+        last = len(index) if end is None else self.seek(end, index)
+        for i in index[first:last]:
+            yield int(self.timeStamps[i]), self.getLine(i)
+
+    def close(self):
+        if self.file is not None:
+            if self.map is not None:
+                self.map.close()
+            self.file.close()
+            self.file = None
+        self.map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
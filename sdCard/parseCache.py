@@ -0,0 +1,177 @@
+'''
+cache of parsed hourly log files
+
+parsing the hourly csv logs with np.loadtxt is the slow part of every
+report, and the logs never change once an hour is over.  ParseCache keeps
+each parsed file as a binary .npy file, keyed by the log's path, size,
+mtime and the dtype it was parsed with, so a changed log is parsed again.
+the disk tier is capped at maxBytes and the least recently used entries
+are removed first.  recently used arrays are also kept in memory, up to
+maxMemoryBytes
+
+    cache = parseCache.ParseCache('cache/')
+    data = cache.load(fileName, dtype, parseFunction)
+'''
+
+import collections
+import hashlib
+import os
+import numpy as np
+
+
+class ParseCache(object):
+    def __init__(self, directory, maxBytes=2 * 1024 ** 3,
+                 maxMemoryBytes=256 * 1024 ** 2):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.maxMemoryBytes = maxMemoryBytes
+        # key to array, least recently used first
+        self.memory = collections.OrderedDict()
+        self.memoryBytes = 0
+        # file name to [last use, size] for the disk tier, read lazily
+        self.index = None
+        self.diskBytes = 0
+
+    def getKey(self, fileName, dtype):
+        '''
+        cache key for a log file in its current state parsed as dtype
+        '''
+        fileStat = os.stat(fileName)
+        key = '%s|%d|%r|%r' % (os.path.abspath(fileName), fileStat.st_size,
+                               fileStat.st_mtime, np.dtype(dtype).descr)
+        return hashlib.sha1(key).hexdigest()
+
+    def isCached(self, fileName, dtype):
+        '''
+        True if load would not have to parse fileName, False as well if
+        the file does not exist
+        '''
+        try:
+            key = self.getKey(fileName, dtype)
+        except OSError:
+            return False
+        return (key in self.memory or
+                os.path.isfile(self.getFileName(key)))
+
+    def load(self, fileName, dtype, parse):
+        '''
+        return the array for fileName parsed as dtype, calling
+        parse(fileName, dtype) only if it is not cached.  the returned
+        array is shared with the cache and read only
+        '''
+        key = self.getKey(fileName, dtype)
+        data = self.loadMemory(key)
+        if data is not None:
+            return data
+        data = self.loadDisk(key)
+        if data is None:
+            data = parse(fileName, dtype)
+            self.saveDisk(key, data)
+        data.flags.writeable = False
+        self.saveMemory(key, data)
+        return data
+
+    def loadMemory(self, key):
+        data = self.memory.pop(key, None)
+        if data is not None:
+            # move to the most recently used end
+            self.memory[key] = data
+        return data
+
+    def saveMemory(self, key, data):
+        if data.nbytes > self.maxMemoryBytes:
+            return
+        self.memory[key] = data
+        self.memoryBytes += data.nbytes
+        while self.memoryBytes > self.maxMemoryBytes:
+            oldKey, oldData = self.memory.popitem(last=False)
+            self.memoryBytes -= oldData.nbytes
+
+    def getFileName(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def loadDisk(self, key):
+        fileName = self.getFileName(key)
+        try:
+            data = np.load(fileName)
+            # the file mtime records the last use for eviction
+            os.utime(fileName, None)
+        except (IOError, OSError, ValueError):
+            return None
+        if self.index is not None and fileName in self.index:
+            self.index[fileName][0] = os.path.getmtime(fileName)
+        return data
+
+    def saveDisk(self, key, data):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.readIndex()
+        fileName = self.getFileName(key)
+        # write under a temporary name so other processes never load
+        # half a file
+        temporaryFileName = '%s.%d.tmp' % (fileName, os.getpid())
+        file = open(temporaryFileName, 'wb')
+        np.save(file, data)
+        file.close()
+        os.rename(temporaryFileName, fileName)
+        fileStat = os.stat(fileName)
+        if fileName in self.index:
+            self.diskBytes -= self.index[fileName][1]
+        self.index[fileName] = [fileStat.st_mtime, fileStat.st_size]
+        self.diskBytes += fileStat.st_size
+        self.evict()
+
+    def readIndex(self):
+        '''
+        list the cache directory once to learn the size and last use of
+        every entry
+        '''
+        if self.index is not None:
+            return
+        self.index = {}
+        self.diskBytes = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npy'):
+                continue
+            fileName = os.path.join(self.directory, name)
+            try:
+                fileStat = os.stat(fileName)
+            except OSError:
+                continue
+            self.index[fileName] = [fileStat.st_mtime, fileStat.st_size]
+            self.diskBytes += fileStat.st_size
+
+    def evict(self):
+        '''
+        remove least recently used entries until the disk tier fits in
+        maxBytes
+        '''
+        if self.diskBytes <= self.maxBytes:
+            return
+        for fileName in sorted(self.index.keys(),
+                               key=lambda f: self.index[f][0]):
+            if self.diskBytes <= self.maxBytes:
+                break
+            try:
+                os.remove(fileName)
+            except OSError:
+                # already removed by another process
+                pass
+            self.diskBytes -= self.index.pop(fileName)[1]
+
+    def clear(self):
+        '''
+        remove every cached entry from memory and disk
+        '''
+        self.memory.clear()
+        self.memoryBytes = 0
+        if not os.path.isdir(self.directory):
+            return
+        self.readIndex()
+        for fileName in self.index.keys():
+            try:
+                os.remove(fileName)
+            except OSError:
+                pass
+        self.index = {}
+        self.diskBytes = 0
@@ -0,0 +1,146 @@
+'''
+mergeable fixed bin histograms of power
+
+a PowerHistogram counts values into fixed bins as they stream past, so a
+year of per second watts can be summarized one chunk at a time in a few
+kilobytes.  histograms with the same bins merge exactly by adding
+counts, so months or pool workers can be summarized separately and
+combined.  quantiles and load duration curves are read from the bins and
+are exact to within one bin width
+
+    histogram = powerHistogram.linearHistogram(2000, 5)
+    for chunk in chunks:
+        histogram.add(chunk['Watts'])
+    total.merge(histogram)
+'''
+
+import numpy as np
+
+
+class PowerHistogram(object):
+    '''
+    counts of values in the bins between consecutive binEdges, with
+    values below the first edge or at or above the last edge counted in
+    underflow and overflow.  the exact count, total, min and max of the
+    values are kept as well
+    '''
+    def __init__(self, binEdges):
+        self.binEdges = np.asarray(binEdges, dtype=float)
+        if len(self.binEdges) < 2 or (np.diff(self.binEdges) <= 0).any():
+            raise ValueError('binEdges must be increasing')
+        self.counts = np.zeros(len(self.binEdges) - 1)
+        self.underflow = 0.0
+        self.overflow = 0.0
+        self.count = 0.0
+        self.total = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def add(self, values, weights=None):
+        '''
+        count an array of values, each with weight 1 or the matching
+        entry of weights (such as the hours a sample stands for).  nan
+        values are skipped
+        '''
+        values = np.asarray(values, dtype=float).ravel()
+        if weights is None:
+            weights = np.ones(len(values))
+        else:
+            weights = np.asarray(weights, dtype=float).ravel()
+        keep = ~np.isnan(values)
+        values = values[keep]
+        weights = weights[keep]
+        if len(values) == 0:
+            return
+        bins = np.searchsorted(self.binEdges, values, 'right') - 1
+        under = bins < 0
+        over = bins >= len(self.counts)
+        self.underflow += weights[under].sum()
+        self.overflow += weights[over].sum()
+        inside = ~(under | over)
+        self.counts += np.bincount(bins[inside], weights=weights[inside],
+                                   minlength=len(self.counts))
+        self.count += weights.sum()
+        self.total += (values * weights).sum()
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+
+    def merge(self, other):
+        '''
+        add the counts of another histogram with the same bins
+        '''
+        if not np.array_equal(self.binEdges, other.binEdges):
+            raise ValueError('histograms have different bins')
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def mean(self):
+        if self.count == 0:
+            return np.nan
+        return self.total / self.count
+
+    def quantile(self, q):
+        '''
+        value below which a fraction q of the weight lies, interpolated
+        within its bin.  q may be an array
+        '''
+        q = np.asarray(q, dtype=float)
+        if self.count == 0:
+            return np.full(q.shape, np.nan)
+        # cumulative weight at every edge, with the under and overflow
+        # placed at the min and max seen
+        edges = np.concatenate(([min(self.min, self.binEdges[0])],
+                                self.binEdges,
+                                [max(self.max, self.binEdges[-1])]))
+        weights = np.concatenate(([self.underflow], self.counts,
+                                  [self.overflow]))
+        cumulative = np.concatenate(([0], np.cumsum(weights)))
+        result = np.interp(q * self.count, cumulative, edges)
+        return np.clip(result, self.min, self.max)
+
+    def durationCurve(self):
+        '''
+        load duration curve: for each bin edge, the weight (such as
+        hours) spent at or above that value.  returns (edges, weight)
+        '''
+        atOrAbove = (np.cumsum(self.counts[::-1])[::-1] + self.overflow)
+        atOrAbove = np.concatenate((atOrAbove, [self.overflow]))
+        return self.binEdges, atOrAbove
+
+    def save(self, fileName):
+        file = open(fileName, 'wb')
+        np.savez(file, binEdges=self.binEdges, counts=self.counts,
+                 summary=np.array([self.underflow, self.overflow, self.count,
+                                   self.total, self.min, self.max]))
+        file.close()
+
+def loadHistogram(fileName):
+    archive = np.load(fileName)
+    histogram = PowerHistogram(archive['binEdges'])
+    histogram.counts = archive['counts']
+    (histogram.underflow, histogram.overflow, histogram.count,
+     histogram.total, histogram.min, histogram.max) = archive['summary']
+    archive.close()
+    return histogram
+
+def linearHistogram(maxValue, binWidth, minValue=0):
+    '''
+    empty histogram with bins binWidth wide from minValue to maxValue
+    '''
+    numBins = int(np.ceil((maxValue - minValue) / float(binWidth)))
+    return PowerHistogram(minValue + np.arange(numBins + 1) * float(binWidth))
+
+def mergeHistograms(histogramList):
+    '''
+    new histogram holding the merged counts of a list of histograms
+    '''
+    merged = PowerHistogram(histogramList[0].binEdges)
+    for histogram in histogramList:
+        merged.merge(histogram)
+    return merged
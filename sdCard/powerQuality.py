@@ -0,0 +1,250 @@
+'''
+power quality of the mains from the sd card logs
+
+a PowerQualityAnalyzer is fed the mains (192_168_1_200.log) record arrays
+a chunk at a time, in time order, and keeps only
+
+  - events, runs of consecutive samples with the volts below the sag or
+    above the swell limit, the frequency outside its band or the power
+    factor low while power is drawn.  an event still open at the end of
+    a chunk is carried into the next one
+  - one row of summary statistics per hour
+
+so months of mains data can be scanned in bounded memory.  results for
+consecutive ranges, such as months done by separate workers, are joined
+with mergeResults
+
+    analyzer = powerQuality.PowerQualityAnalyzer()
+    for data in chunks:
+        analyzer.add(data)
+    events, summary, span = analyzer.finish()
+'''
+
+import datetime
+import numpy as np
+import timeStamps
+
+summaryNames = ['samples', 'meanVolts', 'minVolts', 'maxVolts',
+                'meanFrequency', 'minFrequency', 'maxFrequency',
+                'meanPowerFactor', 'minPowerFactor']
+columnNames = ['Watts', 'Volts', 'Frequency', 'Power Factor']
+
+
+class PowerQualityAnalyzer(object):
+    '''
+    events are (kind, start, end, extreme value, samples) with start and
+    end the epoch seconds of the first and last sample in the event.
+    the extreme is the lowest volts of a sag, the highest of a swell, the
+    largest frequency error in hz and the lowest power factor.  samples
+    further apart than maxGap seconds end an event
+    '''
+    def __init__(self, nominalVolts=230.0, sagFraction=0.9,
+                 swellFraction=1.1, nominalFrequency=50.0,
+                 frequencyTolerance=0.5, minPowerFactor=0.8, minWatts=10.0,
+                 maxGap=60):
+        self.sagVolts = nominalVolts * sagFraction
+        self.swellVolts = nominalVolts * swellFraction
+        self.nominalFrequency = nominalFrequency
+        self.frequencyTolerance = frequencyTolerance
+        self.minPowerFactor = minPowerFactor
+        self.minWatts = minWatts
+        self.maxGap = maxGap
+        self.events = []
+        # kind to [start, end, extreme, samples] of an event that reached
+        # the end of the last chunk
+        self.openEvents = {}
+        self.firstSecond = None
+        self.lastSecond = None
+        self.summaryChunks = []
+
+    def getEventMasks(self, data):
+        '''
+        kind to (mask of samples in an event, value to report the extreme
+        of, True if the extreme is the minimum)
+        '''
+        volts = data['Volts']
+        frequency = data['Frequency']
+        powerFactor = data['Power Factor']
+        frequencyError = np.abs(frequency - self.nominalFrequency)
+        return {'sag': (volts < self.sagVolts, volts, True),
+                'swell': (volts > self.swellVolts, volts, False),
+                'frequency': (frequencyError > self.frequencyTolerance,
+                              frequencyError, False),
+                'lowPowerFactor': ((powerFactor < self.minPowerFactor) &
+                                   (data['Watts'] > self.minWatts),
+                                   powerFactor, True)}
+
+    def add(self, data):
+        '''
+        analyze the next chunk of a mains record array, which must come
+        after every earlier chunk.  chunks should start on the hour so
+        each hour is summarized from one chunk
+        '''
+        if len(data) == 0:
+            return
+        seconds = timeStamps.timeStampArrayToEpoch(data['Time Stamp'])
+        order = np.argsort(seconds, kind='mergesort')
+        seconds = seconds[order]
+        data = data[order]
+        # a gap before this chunk closes any open event
+        if (self.lastSecond is not None and
+            seconds[0] - self.lastSecond > self.maxGap):
+            self.closeOpenEvents()
+        # a long gap inside the chunk splits runs
+        newRun = np.concatenate(([False], np.diff(seconds) > self.maxGap))
+        for kind, (mask, values, isMinimum) in sorted(
+                self.getEventMasks(data).items()):
+            self.addEvents(kind, seconds, mask, values, isMinimum, newRun)
+        if self.firstSecond is None:
+            self.firstSecond = seconds[0]
+        self.lastSecond = seconds[-1]
+        self.summaryChunks.append(summarizeHours(seconds, data))
+
+    def addEvents(self, kind, seconds, mask, values, isMinimum, newRun):
+        # runs of the mask, also broken where the samples have a gap
+        starts = np.flatnonzero(mask & (np.concatenate(([True], ~mask[:-1])) |
+                                        newRun))
+        ends = np.flatnonzero(mask & (np.concatenate((~mask[1:], [True])) |
+                                      np.concatenate((newRun[1:], [False]))))
+        if len(starts) == 0:
+            if kind in self.openEvents:
+                self.events.append(tuple([kind] + self.openEvents.pop(kind)))
+            return
+        reduce = np.minimum if isMinimum else np.maximum
+        # reduce each run alone by reducing from every start and every
+        # end + 1, with a padding value so an end + 1 can be past the data
+        bounds = np.column_stack((starts, ends + 1)).ravel()
+        padded = np.concatenate((np.asarray(values, dtype=float), [0]))
+        extremes = reduce.reduceat(padded, bounds)[::2]
+        runs = [[seconds[s], seconds[e], extremes[i], e - s + 1]
+                for i, (s, e) in enumerate(zip(starts, ends))]
+        if kind in self.openEvents:
+            openEvent = self.openEvents.pop(kind)
+            if starts[0] == 0:
+                # the open event continues into this chunk
+                first = runs[0]
+                runs[0] = [openEvent[0], first[1],
+                           reduce(openEvent[2], first[2]),
+                           openEvent[3] + first[3]]
+            else:
+                self.events.append(tuple([kind] + openEvent))
+        if ends[-1] == len(seconds) - 1:
+            self.openEvents[kind] = runs.pop()
+        for run in runs:
+            self.events.append(tuple([kind] + run))
+
+    def closeOpenEvents(self):
+        for kind in sorted(self.openEvents.keys()):
+            self.events.append(tuple([kind] + self.openEvents[kind]))
+        self.openEvents = {}
+
+    def finish(self):
+        '''
+        close any open events and return (events sorted by start, hourly
+        summary, (first, last) epoch seconds of the samples seen or None),
+        which is the form mergeResults joins
+        '''
+        self.closeOpenEvents()
+        self.events.sort(key=lambda event: (event[1], event[0]))
+        summary = concatenateSummaries(self.summaryChunks)
+        span = None
+        if self.firstSecond is not None:
+            span = (self.firstSecond, self.lastSecond)
+        return self.events, summary, span
+
+def concatenateSummaries(summaryList):
+    summary = dict((name, np.zeros(0)) for name in summaryNames)
+    summary['hour'] = np.zeros(0, dtype=np.int64)
+    summaryList = [s for s in summaryList if len(s['hour']) > 0]
+    if summaryList:
+        summary = dict((name, np.concatenate([s[name] for s in summaryList]))
+                       for name in ['hour'] + summaryNames)
+    return summary
+
+def summarizeHours(seconds, data):
+    '''
+    summary statistics of each hour with samples in a sorted chunk
+    '''
+    hour = seconds // 3600
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(hour)) + 1))
+    count = np.diff(np.concatenate((starts, [len(hour)])))
+    summary = {'hour': hour[starts] * 3600, 'samples': count}
+    for column, name in [('Volts', 'Volts'), ('Frequency', 'Frequency'),
+                         ('Power Factor', 'PowerFactor')]:
+        values = np.asarray(data[column], dtype=float)
+        summary['mean' + name] = np.add.reduceat(values, starts) / count
+        summary['min' + name] = np.minimum.reduceat(values, starts)
+        if 'max' + name in summaryNames:
+            summary['max' + name] = np.maximum.reduceat(values, starts)
+    return summary
+
+def mergeResults(resultList, maxGap=60):
+    '''
+    join the (events, summary, span) results of consecutive ranges, in
+    time order, into one.  an event that reaches the last sample of a
+    range is joined to an event of the same kind that starts at the
+    first sample of the next range, unless the samples are more than
+    maxGap seconds apart
+    '''
+    events = []
+    summaryList = []
+    span = None
+    # kind to the index in events of an event reaching the end of span
+    openIndex = {}
+    for rangeEvents, summary, rangeSpan in resultList:
+        if rangeSpan is None:
+            continue
+        joins = span is not None and rangeSpan[0] - span[1] <= maxGap
+        nextOpenIndex = {}
+        for event in rangeEvents:
+            kind = event[0]
+            if joins and kind in openIndex and event[1] == rangeSpan[0]:
+                i = openIndex[kind]
+                previous = events[i]
+                if kind in ('sag', 'lowPowerFactor'):
+                    extreme = min(previous[3], event[3])
+                else:
+                    extreme = max(previous[3], event[3])
+                events[i] = (kind, previous[1], event[2], extreme,
+                             previous[4] + event[4])
+            else:
+                i = len(events)
+                events.append(event)
+            if event[2] == rangeSpan[1]:
+                nextOpenIndex[kind] = i
+        openIndex = nextOpenIndex
+        summaryList.append(summary)
+        if span is None:
+            span = rangeSpan
+        else:
+            span = (span[0], rangeSpan[1])
+    events.sort(key=lambda event: (event[1], event[0]))
+    return events, concatenateSummaries(summaryList), span
+
+def writeEventCSV(fileName, events):
+    '''
+    write one line per event with its kind, first and last sample
+    times, duration in seconds, extreme value and number of samples
+    '''
+    file = open(fileName, 'w')
+    file.write('kind,start,end,seconds,extreme,samples\n')
+    for kind, start, end, extreme, samples in events:
+        line = [kind,
+                datetime.datetime.utcfromtimestamp(start).strftime('%Y%m%d%H%M%S'),
+                datetime.datetime.utcfromtimestamp(end).strftime('%Y%m%d%H%M%S'),
+                str(end - start), '%.3f' % extreme, str(samples)]
+        file.write(','.join(line) + '\n')
+    file.close()
+
+def writeSummaryCSV(fileName, summary):
+    '''
+    write one line of summary statistics per hour with samples
+    '''
+    file = open(fileName, 'w')
+    file.write(','.join(['hour'] + summaryNames) + '\n')
+    for i in range(len(summary['hour'])):
+        hour = datetime.datetime.utcfromtimestamp(summary['hour'][i])
+        line = [hour.strftime('%Y%m%d%H%M%S'), str(summary['samples'][i])]
+        line += ['%.3f' % summary[name][i] for name in summaryNames[1:]]
+        file.write(','.join(line) + '\n')
+    file.close()
@@ -0,0 +1,163 @@
+'''
+background read ahead of the hourly log files
+
+on the synced log share most of the time spent loading a range goes to
+waiting on file reads.  a FilePrefetcher is given the files a loop will
+read, in order, and a few threads read the next ones into memory while
+the caller parses the current one.  it stays at most 'ahead' files and
+roughly maxBytes ahead of the caller, and close() stops the threads
+without reading the rest of the list.  an error reading a file, other
+than the file not existing, is raised by get for that file
+
+    prefetcher = prefetch.FilePrefetcher(fileNameList, ahead=4)
+    try:
+        for fileName in fileNameList:
+            content = prefetcher.get(fileName)
+            if content is not None:
+                ...
+    finally:
+        prefetcher.close()
+'''
+
+import errno
+import threading
+
+
+class FilePrefetcher(object):
+    def __init__(self, fileNameList, ahead=4, threads=2,
+                 maxBytes=64 * 1024 ** 2):
+        self.fileNameList = list(fileNameList)
+        self.ahead = ahead
+        self.maxBytes = maxBytes
+        # index of the next file to read and of the next file get returns
+        self.next = 0
+        self.consumed = 0
+        # file index to its content, None for a file that does not exist
+        self.contentDict = {}
+        # file index to the exception raised reading it
+        self.errorDict = {}
+        self.bufferedBytes = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.threadList = []
+        for i in range(threads):
+            thread = threading.Thread(target=self.readFiles)
+            thread.daemon = True
+            thread.start()
+            self.threadList.append(thread)
+
+    def readFiles(self):
+        '''
+        thread body, reads files in list order while within the limits
+        '''
+        while True:
+            self.condition.acquire()
+            try:
+                while not self.closed and not self.canRead():
+                    self.condition.wait()
+                if self.closed:
+                    return
+                i = self.next
+                self.next += 1
+            finally:
+                self.condition.release()
+            error = None
+            content = None
+            try:
+                content = readFile(self.fileNameList[i])
+            except Exception, e:
+                error = e
+            self.condition.acquire()
+            try:
+                # keep it unless the caller skipped it while it was read
+                if i >= self.consumed:
+                    if error is not None:
+                        self.errorDict[i] = error
+                    else:
+                        self.contentDict[i] = content
+                        if content is not None:
+                            self.bufferedBytes += len(content)
+                self.condition.notifyAll()
+            finally:
+                self.condition.release()
+
+    def canRead(self):
+        return (self.next < len(self.fileNameList) and
+                self.next < self.consumed + self.ahead and
+                self.bufferedBytes < self.maxBytes)
+
+    def get(self, fileName):
+        '''
+        content of fileName, or None if it does not exist, waiting for it
+        to be read, and raising the error if reading it failed.  files
+        must be asked for in list order, files that are skipped are
+        dropped
+        '''
+        self.condition.acquire()
+        try:
+            i = self.fileNameList.index(fileName, self.consumed)
+            # drop skipped files and read from fileName on
+            for j in range(self.consumed, i):
+                self.dropContent(j)
+            self.consumed = i
+            self.next = max(self.next, i)
+            self.condition.notifyAll()
+            while (i not in self.contentDict and i not in self.errorDict and
+                   not self.closed):
+                self.condition.wait()
+            if self.closed:
+                raise ValueError('prefetcher is closed')
+            error = self.errorDict.pop(i, None)
+            content = self.dropContent(i)
+            self.consumed = i + 1
+            self.condition.notifyAll()
+            if error is not None:
+                raise error
+            return content
+        finally:
+            self.condition.release()
+
+    def dropContent(self, i):
+        self.errorDict.pop(i, None)
+        content = self.contentDict.pop(i, None)
+        if content is not None:
+            self.bufferedBytes -= len(content)
+        return content
+
+    def close(self):
+        '''
+        stop the threads, waiting only for reads already started
+        '''
+        self.condition.acquire()
+        try:
+            self.closed = True
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+        for thread in self.threadList:
+            thread.join()
+        self.contentDict = {}
+        self.errorDict = {}
+        self.bufferedBytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def readFile(fileName):
+    '''
+    whole content of a file, or None if it does not exist.  other errors
+    are raised
+    '''
+    try:
+        file = open(fileName, 'rb')
+    except IOError, e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+    try:
+        return file.read()
+    finally:
+        file.close()
@@ -1,4 +1,6 @@
 import os
+import multiprocessing
+import StringIO
 import numpy as np
 import dateutil.parser
 import matplotlib.dates
@@ -9,89 +11,242 @@ import dateutil.parser
 import matplotlib.dates
 import datetime
 import scipy.integrate
+import timeStamps
+import parseCache
+import logManifest
+import hourlyRollup
+import powerHistogram
+import prefetch
+import dayProfile
+import counterEnergy
+import powerQuality
 
 verbose = 0
 numColumns = 20
 #dateRangeStart = datetime.datetime(2010, 12, 20)
 dateRangeStart = datetime.datetime(2011, 5, 1)
 dateRangeEnd = datetime.datetime(2011, 5, 18)
+# directory to keep parsed hourly logs in as .npy files, up to
+# parseCacheMaxBytes, such as 'parseCache/', or None to always parse
+parseCacheDirectory = None
+parseCacheMaxBytes = 2 * 1024 ** 3
+logCache = None
+# processes used by calculateDailyUsage, 1 to run serially
+usageProcesses = 1
+# hourly usage rollup kept up to date by writeHourlyUsageCSV
+hourlyRollupFileName = 'hourlyRollup.npz'
+usageCircuitList = ['200','201','202','203','204','205','206','207','208','209',
+                    '210','211','212','213','214','215','216','217','218','219','220']
+# samples further apart than this many seconds add no energy to the rollup
+rollupMaxGap = 60
+# bins of the power histograms and load duration curve
+histogramBinWidth = 5
+histogramMaxWatts = 2000
+
+# mains circuit and keyword arguments of powerQuality.PowerQualityAnalyzer
+mainsCircuit = '200'
+powerQualityLimits = {'nominalVolts': 230.0, 'nominalFrequency': 50.0}
+
+# columns of the hourly logs, the mains (200) log has no 'Credit'
+logColumnList = [('Time Stamp',       'S14'),
+                 ('Watts',            'float'),
+                 ('Volts',            'float'),
+                 ('Amps',             'float'),
+                 ('Watt Hours SC20',  'float'),
+                 ('Watt Hours Today', 'float'),
+                 ('Max Watts',        'float'),
+                 ('Max Volts',        'float'),
+                 ('Max Amps',         'float'),
+                 ('Min Watts',        'float'),
+                 ('Min Volts',        'float'),
+                 ('Min Amps',         'float'),
+                 ('Power Factor',     'float'),
+                 ('Power Cycle',      'float'),
+                 ('Frequency',        'float'),
+                 ('Volt Amps',        'float'),
+                 ('Relay Not Closed', 'float'),
+                 ('Send Rate',        'float'),
+                 ('Machine ID',       'float'),
+                 ('Type',             'S8'),
+                 ('Credit',           'float')]
 
 # helper functions
 # ----------------
 
+def getLogDtype(circuit, columns = None):
+    '''
+    record dtype of the hourly log of a circuit, limited to 'Time Stamp'
+    and the names in columns if given.  columns the circuit does not log
+    ('Credit' for the mains) are left out
+    '''
+    if '200' in circuit:
+        columnList = logColumnList[0:-1]
+    else:
+        columnList = logColumnList
+    if columns is not None:
+        columnList = [c for c in columnList
+                      if c[0] == 'Time Stamp' or c[0] in columns]
+    return np.dtype(columnList)
+
+def getLogFileName(circuit, hour, dataDirectory = 'data/'):
+    '''
+    path of the log file of a circuit for an hour
+    '''
+    # construct path for certain hour of data
+    path = '%02d/%02d/%02d/%02d/' % (hour.year, hour.month, hour.day,
+                                     hour.hour)
+    return str(dataDirectory) + path + '192_168_1_' + str(circuit) + '.log'
+
 def getFormattedData(circuit = '201',
                      beginDatetime = dateRangeStart,
                      endDatetime = dateRangeEnd,
                      dataDirectory = 'data/',
-                     verbose = 1):
+                     verbose = 1,
+                     manifest = None,
+                     columns = None,
+                     prefetchHours = 0):
     '''
     read in data from directories from begin date to end date
-    and return numpy record array
-    '''
-    list = [('Time Stamp',       'S14'),
-            ('Watts',            'float'),
-            ('Volts',            'float'),
-            ('Amps',             'float'),
-            ('Watt Hours SC20',  'float'),
-            ('Watt Hours Today', 'float'),
-            ('Max Watts',        'float'),
-            ('Max Volts',        'float'),
-            ('Max Amps',         'float'),
-            ('Min Watts',        'float'),
-            ('Min Volts',        'float'),
-            ('Min Amps',         'float'),
-            ('Power Factor',     'float'),
-            ('Power Cycle',      'float'),
-            ('Frequency',        'float'),
-            ('Volt Amps',        'float'),
-            ('Relay Not Closed', 'float'),
-            ('Send Rate',        'float'),
-            ('Machine ID',       'float'),
-            ('Type',             'S8'),
-            ('Credit',           'float')]
-    typeCircuit = np.dtype(list)
-    typeMains = np.dtype(list[0:-1])
+    and return numpy record array, which is empty (but still typed) if
+    there are no logs.  given a logManifest of dataDirectory only the
+    hours it lists for the circuit are read.  given a list of columns
+    only those and 'Time Stamp' are parsed and returned.  with
+    prefetchHours, background threads read that many hours ahead of the
+    one being parsed, skipping files already in the parse cache
+    '''
+    type = getLogDtype(circuit, columns)
 
-    if '200' in circuit:
-        type = typeMains
+    filename = '192_168_1_' + str(circuit) + '.log'
+    if manifest is not None:
+        hourList = manifest.getHours(beginDatetime, endDatetime, filename)
     else:
-        type = typeCircuit
+        hourList = []
+        currentDatetime = beginDatetime
+        while currentDatetime != endDatetime:
+            hourList.append(currentDatetime)
+            # increment by one hour
+            currentDatetime = currentDatetime + datetime.timedelta(hours=1)
+
+    # collect every hour and concatenate once at the end, so loading
+    # is linear in the number of hours
+    chunks = []
+    prefetchList = []
+    prefetcher = None
+    if prefetchHours > 0:
+        cache = getLogCache()
+        for currentDatetime in hourList:
+            file = getLogFileName(circuit, currentDatetime, dataDirectory)
+            if cache is None or not cache.isCached(file, type):
+                prefetchList.append(file)
+        prefetcher = prefetch.FilePrefetcher(prefetchList, ahead=prefetchHours)
+    prefetchSet = set(prefetchList)
+    try:
+        for currentDatetime in hourList:
+            file = getLogFileName(circuit, currentDatetime, dataDirectory)
 
-    currentDatetime = beginDatetime
-    data = []
-    while currentDatetime != endDatetime:
-        # construct path for certain hour of data
-        path  = str(currentDatetime.year) + '/'
-        path += str(currentDatetime.month) + '/'
-        path += str(currentDatetime.day) + '/'
-        path += str(currentDatetime.hour)
-        path = '%02d/%02d/%02d/%02d/' % (currentDatetime.year,
-                                         currentDatetime.month,
-                                         currentDatetime.day,
-                                         currentDatetime.hour)
-        filename = '192_168_1_' + str(circuit) + '.log'
-        file = str(dataDirectory) + str(path) + str(filename)
-
-        if verbose >= 1:
-            print 'reading ' + file
-
-        # read log file
-        if os.path.isfile(file):
             if verbose >= 1:
-                print 'found ' + file
-            newData = np.loadtxt(file, delimiter=',', dtype = type, skiprows = 1)
-            # if newData is only one line it is a pita so discard it
-            # fixme: figure out how to append these one line logs
-            if newData.shape != ():
-                if data == []:
-                    data = newData
-                else:
-                    data = np.append(data, newData, axis=0)
+                print 'reading ' + file
 
-        # increment by one hour
-        currentDatetime = currentDatetime + datetime.timedelta(hours=1)
+            if file in prefetchSet:
+                # the prefetcher has no content for files that do not exist
+                content = prefetcher.get(file)
+                if content is not None:
+                    if verbose >= 1:
+                        print 'found ' + file
+                    chunks.append(loadLogFile(file, type, content))
+            # read log file, the manifest only lists files that exist
+            elif manifest is not None or os.path.isfile(file):
+                if verbose >= 1:
+                    print 'found ' + file
+                chunks.append(loadLogFile(file, type))
+    finally:
+        if prefetcher is not None:
+            prefetcher.close()
 
-    return data
+    if not chunks:
+        return np.zeros(0, dtype=type)
+    return np.concatenate(chunks)
+
+def getLogCache():
+    '''
+    the ParseCache in parseCacheDirectory, created on first use, or
+    None if caching is turned off
+    '''
+    global logCache
+    if logCache is None and parseCacheDirectory is not None:
+        logCache = parseCache.ParseCache(parseCacheDirectory,
+                                         parseCacheMaxBytes)
+    return logCache
+
+def loadLogFile(file, type, content = None):
+    '''
+    parsed record array for one hourly log file, from the parse cache
+    when the file has not changed since it was cached.  the array is
+    read only when it comes from the cache.  content is the text of the
+    file if it was already read
+    '''
+    if content is None:
+        parse = readLogFile
+    else:
+        parse = lambda file, type: readLogFile(StringIO.StringIO(content), type)
+    cache = getLogCache()
+    if cache is None:
+        return parse(file, type)
+    return cache.load(file, type, parse)
+
+def getLastValue(circuit = '201',
+                 beginDatetime = dateRangeStart,
+                 endDatetime = dateRangeEnd,
+                 column = 'Watt Hours Today',
+                 dataDirectory = 'data/',
+                 manifest = None):
+    '''
+    value of column in the last sample from begin date to end date, the
+    same as getFormattedData(...)[column][-1], or None if there are no
+    samples.  only the tail of the last hourly file is read, going back
+    to earlier hours when a file is missing or has no complete line
+    '''
+    type = getLogDtype(circuit)
+    columnIndex = type.names.index(column)
+    filename = '192_168_1_' + str(circuit) + '.log'
+    if manifest is not None:
+        hourList = manifest.getHours(beginDatetime, endDatetime, filename)
+    else:
+        hourList = []
+        currentDatetime = beginDatetime
+        while currentDatetime != endDatetime:
+            hourList.append(currentDatetime)
+            currentDatetime = currentDatetime + datetime.timedelta(hours=1)
+
+    for currentDatetime in reversed(hourList):
+        file = getLogFileName(circuit, currentDatetime, dataDirectory)
+        if manifest is None and not os.path.isfile(file):
+            continue
+        logFile = open(file, 'rb')
+        try:
+            for line in logManifest.iterDataLinesBackwards(logFile):
+                fields = line.rstrip('\r').split(',')
+                # skip a line cut short by a write in progress
+                if len(fields) != len(type.names):
+                    continue
+                try:
+                    return float(fields[columnIndex])
+                except ValueError:
+                    continue
+        finally:
+            logFile.close()
+    return None
+
+def readLogFile(file, type):
+    '''
+    parse one hourly log file into a record array.  np.loadtxt returns a
+    zero dimensional array for one line logs, so these are reshaped to
+    a one row array.  only the log columns named in type are parsed
+    '''
+    logColumnNames = [c[0] for c in logColumnList]
+    usecols = [logColumnNames.index(name) for name in type.names]
+    return np.atleast_1d(np.loadtxt(file, delimiter=',', dtype = type,
+                                    skiprows = 1, usecols = usecols))
 
 def getData(plotCircuit, plotDate, downsample, dataDirectory):
     '''
@@ -175,92 +330,316 @@ def resampleData(data, column, dateStart, dateEnd, dt):
     '''
     given a numpy record array and dateStarts and ends and a timestep
     this function will place samples of data on evenly spaced timesteps
-    and will attempt to do the right thing in areas with no data
+    and will attempt to do the right thing in areas with no data.
+    each step takes the nearest sample (the later one on a tie) if it is
+    less than dt seconds away.  steps with no such sample are zero for
+    'Watts' and hold the previous step's value for other columns.
+    returns a datetime64[s] array of step times and the values
     '''
-    # parsedDates are datetime objects
     if verbose == 1:
         print 'parsing dates'
-    parsedDates = [dateutil.parser.parse(t) for t in data['Time Stamp']]
-    # mplDates are days
-    mplDates = matplotlib.dates.date2num(parsedDates)
+    # oldSeconds are sample times in seconds after dateStart
+    oldSeconds = (timeStamps.timeStampArrayToEpoch(data['Time Stamp']) -
+                  timeStamps.datetimeToEpoch(dateStart))
+    oldValues = data[column]
 
-
-    oldSeconds = [(date - dateStart).days * 86400 +
-                  (date - dateStart).seconds for date in parsedDates]
-
-    # loop through newSeconds and find new values
-    # for power, if no neighboring value, power = 0
     # make newSeconds deal with dateStart and dateEnd
     totalSeconds = (dateEnd - dateStart).days * 86400 + (dateEnd - dateStart).seconds
     newSeconds = np.arange(0, totalSeconds+1, dt)
-
-    newPower = np.zeros(len(newSeconds))
     threshold = dt
 
-    if column == 'Watts':
-        findMethod = 1
-        if findMethod == 0:
-            if verbose == 1:
-                print 'finding samples brute force'
-            for i, second in enumerate(newSeconds):
-                # find nearest oldSeconds sample
-                delta = min(abs(oldSeconds - second))
-                index = np.argmin(abs(oldSeconds - second))
-                if delta < 15:
-                    newPower[i] = data[column][index]
-
-        if findMethod == 1:
-            # this section does not work yet
-            if verbose == 1:
-                print 'finding samples indexing'
-            ind = 0
-            for i, sec in enumerate(newSeconds):
-                while 1:
-                    if ind == len(oldSeconds) -1:
-                        newPower[i] = 0
-                        break
-                    dt1 = abs(oldSeconds[ind]-sec)
-                    dt2 = abs(oldSeconds[ind+1]-sec)
-                    if dt2 > dt1:
-                        if dt1 < threshold:
-                            newPower[i] = data[column][ind]
-                        else:
-                            newPower[i] = 0
-                        break
-                    ind += 1
-    else:
-        ind = 0
-        for i, sec in enumerate(newSeconds):
-            while 1:
-                if ind == len(oldSeconds) -1:
-                    newPower[i] = newPower[i-1]
-                    break
-                dt1 = abs(oldSeconds[ind]-sec)
-                dt2 = abs(oldSeconds[ind+1]-sec)
-                if dt2 > dt1:
-                    if dt1 < threshold:
-                        newPower[i] = data[column][ind]
-                    else:
-                        if i == 0:
-                            newPower[i] = 0
-                        else:
-                            newPower[i] = newPower[i-1]
-                    break
-                ind += 1
-
-    # convert newSeconds to datetime objects
-    newTime = []
-    for second in newSeconds:
-        deltaDays = second / 86400
-        deltaSeconds = second % 86400
-        newTime.append(dateStart+ datetime.timedelta(days = int(deltaDays),
-                                                     seconds = int(deltaSeconds)))
+    if verbose == 1:
+        print 'finding samples indexing'
+    nearest, valid = findNearestSamples(oldSeconds, newSeconds, threshold)
+    newPower = fillResampledColumn(oldValues, nearest, valid, column)
 
+    newTime = (np.datetime64(dateStart, 's') +
+               newSeconds.astype('timedelta64[s]'))
 
     if verbose == 1:
         print 'returning result'
     return newTime, newPower
 
+def findNearestSamples(oldSeconds, newSeconds, threshold):
+    '''
+    for each of newSeconds, the index in the sorted oldSeconds of the
+    nearest sample, preferring the later sample on a tie, and a mask of
+    the steps where that sample is less than threshold away
+    '''
+    if len(oldSeconds) == 0:
+        return (np.zeros(len(newSeconds), dtype=int),
+                np.zeros(len(newSeconds), dtype=bool))
+    # oldSeconds[after - 1] <= second < oldSeconds[after]
+    after = np.searchsorted(oldSeconds, newSeconds, 'right')
+    before = np.maximum(after - 1, 0)
+    after = np.minimum(after, len(oldSeconds) - 1)
+    beforeDistance = np.abs(oldSeconds[before] - newSeconds)
+    afterDistance = np.abs(oldSeconds[after] - newSeconds)
+    nearest = np.where(afterDistance <= beforeDistance, after, before)
+    distance = np.minimum(beforeDistance, afterDistance)
+    return nearest, distance < threshold
+
+def fillResampledColumn(oldValues, nearest, valid, column):
+    '''
+    values on the new steps given the nearest samples from
+    findNearestSamples.  steps with no sample are zero for 'Watts' and
+    hold the previous step's value for other columns
+    '''
+    newValues = np.zeros(len(nearest))
+    if column == 'Watts':
+        # for power, if no neighboring value, power = 0
+        newValues[valid] = oldValues[nearest[valid]]
+    else:
+        # carry the last step that had a sample forward over the gaps
+        lastValid = np.where(valid, np.arange(len(nearest)), -1)
+        lastValid = np.maximum.accumulate(lastValid)
+        held = lastValid >= 0
+        newValues[held] = oldValues[nearest[lastValid[held]]]
+    return newValues
+
+def resampleCircuits(dataList, columnList, dateStart, dateEnd, dt):
+    '''
+    place several circuits' record arrays on one grid of dt second steps
+    from dateStart to dateEnd, parsing time stamps and finding the
+    nearest samples once per circuit for all columns in columnList.
+    returns the datetime64[s] step times, a (time, circuit, column)
+    array filled as resampleData does and a (time, circuit) mask of the
+    steps that had a sample.  columns a circuit does not log, such as
+    'Credit' for the mains, are nan
+    '''
+    totalSeconds = (dateEnd - dateStart).days * 86400 + (dateEnd - dateStart).seconds
+    newSeconds = np.arange(0, totalSeconds+1, dt)
+    values = np.empty((len(newSeconds), len(dataList), len(columnList)))
+    valid = np.zeros((len(newSeconds), len(dataList)), dtype=bool)
+    startEpoch = timeStamps.datetimeToEpoch(dateStart)
+    for i, data in enumerate(dataList):
+        if verbose == 1:
+            print 'resampling circuit', i
+        oldSeconds = (timeStamps.timeStampArrayToEpoch(data['Time Stamp']) -
+                      startEpoch)
+        nearest, valid[:, i] = findNearestSamples(oldSeconds, newSeconds, dt)
+        for j, column in enumerate(columnList):
+            if column not in data.dtype.names:
+                values[:, i, j] = np.nan
+                continue
+            values[:, i, j] = fillResampledColumn(data[column], nearest,
+                                                  valid[:, i], column)
+    newTime = (np.datetime64(dateStart, 's') +
+               newSeconds.astype('timedelta64[s]'))
+    return newTime, values, valid
+
+def aggregateData(data, column, dateStart, dateEnd, bucketSeconds,
+                  modes=['mean'], maxGap=60):
+    '''
+    reduce every sample of a record array column into buckets of
+    bucketSeconds from dateStart to dateEnd instead of picking one
+    sample per step.  modes are any of 'mean', 'min', 'max', 'count' and
+    'energy'.  'energy' is the watt-hours in each bucket from the
+    trapezoidal integral of column between consecutive samples, split
+    exactly at bucket edges, where samples more than maxGap seconds
+    apart (maxGap None for no limit) are a gap that adds no energy.
+    returns the datetime64[s] bucket start times and a dictionary of
+    mode to array.  empty buckets have nan mean, min and max
+    '''
+    totalSeconds = (dateEnd - dateStart).days * 86400 + (dateEnd - dateStart).seconds
+    numBuckets = -(-totalSeconds // bucketSeconds)
+    bucketTime = (np.datetime64(dateStart, 's') +
+                  (np.arange(numBuckets) * bucketSeconds).astype('timedelta64[s]'))
+
+    seconds = (timeStamps.timeStampArrayToEpoch(data['Time Stamp']) -
+               timeStamps.datetimeToEpoch(dateStart))
+    order = np.argsort(seconds, kind='mergesort')
+    seconds = seconds[order]
+    values = np.asarray(data[column], dtype=float)[order]
+
+    # samples inside the range, which are contiguous once sorted
+    first = np.searchsorted(seconds, 0, 'left')
+    last = np.searchsorted(seconds, totalSeconds, 'left')
+    bucket = seconds[first:last] // bucketSeconds
+    inRange = values[first:last]
+    count = np.bincount(bucket, minlength=numBuckets)
+    # offsets of the first sample in each nonempty bucket for reduceat
+    occupied = count > 0
+    starts = np.concatenate(([0], np.cumsum(count)[:-1]))[occupied]
+
+    result = {}
+    for mode in modes:
+        if mode == 'count':
+            result[mode] = count
+        elif mode == 'mean':
+            total = np.bincount(bucket, weights=inRange, minlength=numBuckets)
+            result[mode] = np.full(numBuckets, np.nan)
+            result[mode][occupied] = total[occupied] / count[occupied]
+        elif mode in ('min', 'max'):
+            reduce = np.minimum if mode == 'min' else np.maximum
+            result[mode] = np.full(numBuckets, np.nan)
+            if len(starts) > 0:
+                result[mode][occupied] = reduce.reduceat(inRange, starts)
+        elif mode == 'energy':
+            edges = np.arange(numBuckets + 1) * bucketSeconds
+            edges[-1] = totalSeconds
+            result[mode] = np.diff(integrateAtTimes(seconds, values, edges,
+                                                    maxGap))
+        else:
+            raise ValueError('unknown aggregation mode %r' % mode)
+    return bucketTime, result
+
+def integrateAtTimes(seconds, values, times, maxGap=None, capGaps=False):
+    '''
+    trapezoidal integral in watt-hours of values at sorted sample
+    seconds from the first sample up to each of times, treating power
+    as linear between samples no more than maxGap seconds apart.  across
+    longer gaps power is absent, or with capGaps it holds the earlier
+    sample's value for maxGap seconds.  maxGap is a number or an array
+    with one entry for each pair of consecutive samples
+    '''
+    if len(seconds) < 2:
+        return np.zeros(len(times))
+    values = np.asarray(values, dtype=float)
+    width = np.diff(seconds).astype(float)
+    slope = np.zeros(len(width))
+    np.divide(np.diff(values), width, out=slope, where=width > 0)
+    if maxGap is not None:
+        maxGap = np.broadcast_to(maxGap, width.shape)
+        gap = width > maxGap
+        slope[gap] = 0
+        if capGaps:
+            width[gap] = maxGap[gap]
+        else:
+            width[gap] = 0
+    # each interval integrates width seconds of a line from its start
+    energy = np.concatenate(([0], np.cumsum(width * (values[:-1] + slope * width / 2))))
+    # interval holding each time and the part of it before that time
+    interval = np.clip(np.searchsorted(seconds, times, 'right') - 1,
+                       0, len(seconds) - 2)
+    partial = np.clip(times - seconds[interval], 0, width[interval])
+    partialEnergy = partial * (values[interval] + slope[interval] * partial / 2)
+    return (energy[interval] + partialEnergy) / 3600.0
+
+def findGaps(seconds, sendRate, gapFactor=3, maxGap=60):
+    '''
+    the longest allowed time after each sample but the last before the
+    next one, gapFactor times the sample's 'Send Rate' or maxGap when
+    the send rate is missing, and the mask of the pairs of consecutive
+    samples further apart than that
+    '''
+    sendRate = np.asarray(sendRate[:-1], dtype=float)
+    allowed = np.where(sendRate > 0, sendRate * gapFactor, maxGap)
+    return allowed, np.diff(seconds) > allowed
+
+def getHourBounds(dateStart, dateEnd):
+    '''
+    dateStart rounded down and dateEnd rounded up to the hour, the range
+    of whole hourly logs that covers dateStart to dateEnd
+    '''
+    hourStart = dateStart.replace(minute=0, second=0, microsecond=0)
+    hourEnd = dateEnd.replace(minute=0, second=0, microsecond=0)
+    if hourEnd < dateEnd:
+        hourEnd += datetime.timedelta(hours=1)
+    return hourStart, hourEnd
+
+def iterLogChunks(circuit, dateStart, dateEnd, dataDirectory = 'data/',
+                  columns = None, chunkHours = 24, prefetchHours = 0):
+    '''
+    yields (chunk start datetime, seconds since 1970, record array) in
+    time order for each chunk of chunkHours of a circuit's logs that has
+    samples, reading the whole hours that cover dateStart to dateEnd.
+    samples outside dateStart to dateEnd in the first and last hours are
+    included
+    '''
+    loadStart, loadEnd = getHourBounds(dateStart, dateEnd)
+    chunkStart = loadStart
+    while chunkStart < loadEnd:
+        chunkEnd = min(chunkStart + datetime.timedelta(hours=chunkHours),
+                       loadEnd)
+        data = getFormattedData(circuit, chunkStart, chunkEnd,
+                                dataDirectory = dataDirectory, verbose = 0,
+                                columns = columns,
+                                prefetchHours = prefetchHours)
+        if len(data) > 0:
+            seconds = timeStamps.timeStampArrayToEpoch(data['Time Stamp'])
+            order = np.argsort(seconds, kind='mergesort')
+            yield chunkStart, seconds[order], data[order]
+        chunkStart = chunkEnd
+
+def integrateEnergy(circuitList, edgeList, dataDirectory = 'data/',
+                    gapFactor = 3, capGaps = False, chunkHours = 24,
+                    prefetchHours = 0):
+    '''
+    watt-hours each circuit used in each interval between consecutive
+    datetimes of edgeList, from the trapezoidal integral of 'Watts' over
+    the real time between samples.  samples more than gapFactor times
+    their 'Send Rate' apart are a gap, which adds no energy or, with
+    capGaps, holds the earlier watts for the allowed time.  the logs are
+    read chunkHours at a time by iterLogChunks, carrying the last sample
+    of each chunk into the next, so months can be integrated in bounded
+    memory.  returns the (interval, circuit) energy array and a list of
+    (circuit, gap start, gap end) datetimes
+    '''
+    edgeSeconds = np.array([timeStamps.datetimeToEpoch(e) for e in edgeList])
+    energy = np.zeros((len(edgeList) - 1, len(circuitList)))
+    gapList = []
+    for j, circuit in enumerate(circuitList):
+        lastSeconds = np.zeros(0, dtype=np.int64)
+        lastWatts = np.zeros(0)
+        lastSendRate = np.zeros(0)
+        for chunkStart, seconds, data in iterLogChunks(circuit, edgeList[0],
+                                                       edgeList[-1],
+                                                       dataDirectory,
+                                                       ['Watts', 'Send Rate'],
+                                                       chunkHours,
+                                                       prefetchHours):
+            seconds = np.concatenate((lastSeconds, seconds))
+            watts = np.concatenate((lastWatts, data['Watts']))
+            sendRate = np.concatenate((lastSendRate, data['Send Rate']))
+            allowed, gap = findGaps(seconds, sendRate, gapFactor)
+            energy[:, j] += np.diff(integrateAtTimes(seconds, watts,
+                                                     edgeSeconds, allowed,
+                                                     capGaps))
+            inside = ((seconds[1:] > edgeSeconds[0]) &
+                      (seconds[:-1] < edgeSeconds[-1]))
+            for i in np.flatnonzero(gap & inside):
+                gapList.append((circuit,
+                                datetime.datetime.utcfromtimestamp(seconds[i]),
+                                datetime.datetime.utcfromtimestamp(seconds[i + 1])))
+            # the last sample starts the first interval of the next chunk
+            lastSeconds = seconds[-1:]
+            lastWatts = watts[-1:]
+            lastSendRate = sendRate[-1:]
+    return energy, gapList
+
+def getCounterEnergy(circuitList, edgeList, dataDirectory = 'data/',
+                     column = 'Watt Hours Today', resetTolerance = 5.0,
+                     chunkHours = 24, prefetchHours = 0):
+    '''
+    watt-hours each circuit used in each interval between consecutive
+    datetimes of edgeList, from the meter's counter in column with
+    resets and rollbacks handled by counterEnergy.counterEnergy.  the
+    logs are read chunkHours at a time by iterLogChunks, carrying the
+    counter's running high into the next chunk.  returns the (interval,
+    circuit) array
+    '''
+    edgeSeconds = np.array([timeStamps.datetimeToEpoch(e) for e in edgeList])
+    energy = np.zeros((len(edgeList) - 1, len(circuitList)))
+    for j, circuit in enumerate(circuitList):
+        lastSeconds = np.zeros(0, dtype=np.int64)
+        lastCounter = np.zeros(0)
+        for chunkStart, seconds, data in iterLogChunks(circuit, edgeList[0],
+                                                       edgeList[-1],
+                                                       dataDirectory, [column],
+                                                       chunkHours,
+                                                       prefetchHours):
+            seconds = np.concatenate((lastSeconds, seconds))
+            counter = np.concatenate((lastCounter, data[column]))
+            energy[:, j] += counterEnergy.counterEnergy(seconds, counter,
+                                                        edgeSeconds,
+                                                        resetTolerance)
+            high = counterEnergy.classifySteps(seconds, counter,
+                                               resetTolerance)[3]
+            lastSeconds = seconds[-1:]
+            lastCounter = high[-1:]
+    return energy
+
 def getFigure():
     fig = plt.figure()
     axis = fig.add_axes((0.1, 0.1, 0.7, 0.8))
@@ -286,7 +665,9 @@ def writeDailyUsageCSV():
 def calculateDailyUsage():
     '''
     creates csv-like output to stdout with daily usage over a range of
-    days.  also creates graph of usage.  and a histogram
+    days.  also creates graph of usage.  and a histogram.
+    set usageProcesses to compute the days in parallel.  returns the
+    (day, circuit) array of daily usage
     TODO : make this compare against existing CSV of usage and grab data that isn't in file
     '''
     #import ss_plotting as ssp
@@ -314,26 +695,14 @@ def calculateDailyUsage():
     totalWattHours = []
     scWattHours = []
     scDataList = []
-    for day in days:
-        dateStart = dateRangeStart + datetime.timedelta(days=day)
-        dateEnd = dateStart + datetime.timedelta(days=1)
+    dayStartList = [dateRangeStart + datetime.timedelta(days=day) for day in days]
+    usage = getDailyUsage(dayStartList, plotCircuitList, dataDirectory,
+                          usageProcesses)
+    for dateStart, dayUsage in zip(dayStartList, usage):
         totalWattHoursForDay = 0
         print str(dateStart.year) + '/' + str(dateStart.month) + '/' + str(dateStart.day) + ',',
-        for circuit in plotCircuitList:
-            data = getFormattedData(circuit, dateStart, dateEnd, dataDirectory = dataDirectory,
-                                     verbose = 0)
-            if data == []:
-                #print 'no data for', dateStart, circuit
-                integral = 0
-                scwht = 0
-            else:
-                #dts = map(dateutil.parser.parse,data['Time Stamp'])
-                #mpldays = matplotlib.dates.date2num(dts)
-                #integral = scipy.integrate.trapz(data['Watts'],dx=3.0/60/60)
-                scwht = data['Watt Hours Today'][-1]
-
+        for scwht in dayUsage:
             totalWattHoursForDay += scwht
-            #print dateStart.month, dateStart.day, circuit, integral
             #print dateStart.month, dateStart.day, circuit, scwht
             print str(scwht).rjust(5) + ',',
             individualWattHours.append(scwht)
@@ -352,13 +721,253 @@ def calculateDailyUsage():
 
 
     plotHistogram(individualWattHours)
+    return np.array(usage, dtype=float)
+
+def mapCells(function, cellList, processes = 1, chunksize = 1):
+    '''
+    list of function applied to each cell of cellList, in order.  with
+    more than one process the cells are spread over a process pool, so
+    function must be defined at module level and the cells picklable
+    '''
+    if processes <= 1:
+        return map(function, cellList)
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(function, cellList, chunksize)
+    finally:
+        pool.close()
+        pool.join()
 
-def writeHourlyUsageCSV():
+def getDailyUsageCell(cell):
+    '''
+    watt hours a circuit used on the day starting at dateStart, from the
+    meter's 'Watt Hours Today', or 0 if it has no data that day.  cell
+    is (dateStart, circuit, dataDirectory), see mapCells
+    '''
+    dateStart, circuit, dataDirectory = cell
+    dateEnd = dateStart + datetime.timedelta(days=1)
+    # only the last line of the day is needed
+    scwht = getLastValue(circuit, dateStart, dateEnd,
+                         dataDirectory = dataDirectory)
+    if scwht is None:
+        #print 'no data for', dateStart, circuit
+        scwht = 0
+    return scwht
+
+def getDailyUsage(dayStartList, circuitList, dataDirectory = 'data/',
+                  processes = 1):
+    '''
+    list of rows, one per day, of the daily usage of every circuit.
+    with more than one process the (day, circuit) cells are spread over
+    a process pool, and the result is the same as the serial one
+    '''
+    cellList = [(dateStart, circuit, dataDirectory)
+                for dateStart in dayStartList for circuit in circuitList]
+    chunksize = max(1, len(cellList) // (processes * 4))
+    usageList = mapCells(getDailyUsageCell, cellList, processes, chunksize)
+    numCircuits = len(circuitList)
+    return [usageList[i:i + numCircuits]
+            for i in range(0, len(usageList), numCircuits)]
+
+def writeHourlyUsageCSV(fileName = 'hourlyUsage.csv',
+                        dateStart = dateRangeStart,
+                        dateEnd = dateRangeEnd,
+                        dataDirectory = 'data/',
+                        quantities = ['energy']):
     '''
     write csv with hourly watt-hour consumption of all circuits
-    over a given date range
+    over a given date range.  the hours come from the rollup in
+    hourlyRollupFileName, which is brought up to date first so only
+    new or changed logs are read.  quantities can add any of
+    hourlyRollup.quantityList to the default energy
     '''
-    pass
+    rollup = getHourlyRollup(dateStart, dateEnd, dataDirectory)
+    rollup.writeCSV(fileName, dateStart, dateEnd, quantities)
+    return rollup
+
+def getHourlyRollup(dateStart = dateRangeStart,
+                    dateEnd = dateRangeEnd,
+                    dataDirectory = 'data/'):
+    '''
+    the rollup in hourlyRollupFileName, brought up to date from
+    dateStart up to dateEnd and saved if anything changed
+    '''
+    manifest = logManifest.loadManifest(dataDirectory)
+    rollup = hourlyRollup.loadRollup(hourlyRollupFileName, usageCircuitList)
+    updateHourlyRollup(rollup, manifest, dateStart, dateEnd, dataDirectory)
+    if rollup.modified:
+        rollup.save()
+    return rollup
+
+def updateHourlyRollup(rollup, manifest, dateStart, dateEnd,
+                       dataDirectory = 'data/'):
+    '''
+    summarize every hour from dateStart up to dateEnd whose log for a
+    circuit is not in the rollup yet or has changed size or mtime since,
+    and forget hours whose logs were removed.  each hour's energy only
+    integrates between samples of that hour's log
+    '''
+    hourList = manifest.getHours(dateStart, dateEnd)
+    # add the new hours in one go rather than a row at a time
+    rollup.addHours(hourList)
+    for currentDatetime in hourList:
+        for circuit in rollup.circuitList:
+            filename = '192_168_1_' + str(circuit) + '.log'
+            info = manifest.getFileInfo(currentDatetime, filename)
+            if info is None or info[2] is None:
+                if rollup.isCurrent(currentDatetime, circuit, -1, -1):
+                    continue
+                rollup.clearCell(currentDatetime, circuit)
+                continue
+            size, mtime = info[0], info[1]
+            if rollup.isCurrent(currentDatetime, circuit, size, mtime):
+                continue
+            if verbose == 1:
+                print 'summarizing', currentDatetime, circuit
+            file = getLogFileName(circuit, currentDatetime, dataDirectory)
+            data = loadLogFile(file, getLogDtype(circuit, ['Watts']))
+            hourEnd = currentDatetime + datetime.timedelta(hours=1)
+            bucketTime, summary = aggregateData(data, 'Watts',
+                                                currentDatetime, hourEnd, 3600,
+                                                ['energy', 'mean', 'max', 'count'],
+                                                rollupMaxGap)
+            rollup.setCell(currentDatetime, circuit, size, mtime,
+                           summary['energy'][0], summary['mean'][0],
+                           summary['max'][0], summary['count'][0])
+    # hours left in the rollup whose directories are gone
+    listedHours = set(timeStamps.datetimeToEpoch(h) for h in hourList)
+    rows = rollup.getRange(dateStart, dateEnd)
+    for i in range(rows.start, rows.stop):
+        if rollup.hours[i] in listedHours:
+            continue
+        hour = datetime.datetime.utcfromtimestamp(rollup.hours[i])
+        for circuit in rollup.circuitList:
+            if not rollup.isCurrent(hour, circuit, -1, -1):
+                rollup.clearCell(hour, circuit)
+
+def getMonthRanges(dateStart, dateEnd):
+    '''
+    list of (start, end) for the calendar months from dateStart up to
+    dateEnd, clipped to the range
+    '''
+    rangeList = []
+    monthStart = dateStart
+    while monthStart < dateEnd:
+        if monthStart.month == 12:
+            nextMonth = datetime.datetime(monthStart.year + 1, 1, 1)
+        else:
+            nextMonth = datetime.datetime(monthStart.year, monthStart.month + 1, 1)
+        rangeList.append((monthStart, min(nextMonth, dateEnd)))
+        monthStart = nextMonth
+    return rangeList
+
+def getPowerHistogramCell(cell):
+    '''
+    histogram of the per sample watts of a circuit from dateStart up to
+    dateEnd, read a day at a time.  cell is (circuit, dateStart,
+    dateEnd, dataDirectory), see mapCells
+    '''
+    circuit, dateStart, dateEnd, dataDirectory = cell
+    histogram = powerHistogram.linearHistogram(histogramMaxWatts,
+                                               histogramBinWidth)
+    startEpoch = timeStamps.datetimeToEpoch(dateStart)
+    endEpoch = timeStamps.datetimeToEpoch(dateEnd)
+    for chunkStart, seconds, data in iterLogChunks(circuit, dateStart, dateEnd,
+                                                   dataDirectory, ['Watts']):
+        inRange = (seconds >= startEpoch) & (seconds < endEpoch)
+        histogram.add(data['Watts'][inRange])
+    return histogram
+
+def getPowerHistograms(circuitList, dateStart = dateRangeStart,
+                       dateEnd = dateRangeEnd, dataDirectory = 'data/',
+                       processes = 1):
+    '''
+    dictionary of circuit to a PowerHistogram of its watts from
+    dateStart up to dateEnd.  each (circuit, month) is summarized
+    separately, on a process pool if processes is more than 1, and the
+    months are merged
+    '''
+    cellList = [(circuit, monthStart, monthEnd, dataDirectory)
+                for circuit in circuitList
+                for monthStart, monthEnd in getMonthRanges(dateStart, dateEnd)]
+    histogramList = mapCells(getPowerHistogramCell, cellList, processes)
+    histogramDict = {}
+    for cell, histogram in zip(cellList, histogramList):
+        circuit = cell[0]
+        if circuit in histogramDict:
+            histogramDict[circuit].merge(histogram)
+        else:
+            histogramDict[circuit] = histogram
+    return histogramDict
+
+def getDayProfiles(circuitList, dateStart = dateRangeStart,
+                   dateEnd = dateRangeEnd, dataDirectory = 'data/',
+                   binSeconds = 600, splitWeekend = False,
+                   maxWatts = histogramMaxWatts, wattsBinWidth = 1,
+                   prefetchHours = 0):
+    '''
+    dictionary of circuit to a dayProfile.DayProfile of its typical day,
+    from one pass over each circuit's logs from dateStart up to dateEnd.
+    each day adds the mean watts of every binSeconds bin that has
+    samples, so a bin's statistics are across the days with data in it.
+    quantiles above maxWatts are only known to lie between maxWatts and
+    the largest value seen
+    '''
+    profileDict = {}
+    for circuit in circuitList:
+        if verbose == 1:
+            print 'getting data for circuit', circuit
+        profile = dayProfile.DayProfile(binSeconds, splitWeekend, maxWatts,
+                                        wattsBinWidth)
+        for dayStart, seconds, data in iterLogChunks(circuit, dateStart,
+                                                     dateEnd, dataDirectory,
+                                                     ['Watts'], 24,
+                                                     prefetchHours):
+            dayEnd = dayStart + datetime.timedelta(days=1)
+            bucketTime, summary = aggregateData(data, 'Watts', dayStart,
+                                                dayEnd, binSeconds)
+            profile.addDay(dayStart, summary['mean'])
+        profileDict[circuit] = profile
+    return profileDict
+
+def getPowerQualityCell(cell):
+    '''
+    power quality (events, summary, span) of the mains from dateStart up
+    to dateEnd, read a day at a time.  cell is (dateStart, dateEnd,
+    dataDirectory, limits), see mapCells
+    '''
+    dateStart, dateEnd, dataDirectory, limits = cell
+    analyzer = powerQuality.PowerQualityAnalyzer(**limits)
+    startEpoch = timeStamps.datetimeToEpoch(dateStart)
+    endEpoch = timeStamps.datetimeToEpoch(dateEnd)
+    for chunkStart, seconds, data in iterLogChunks(mainsCircuit, dateStart,
+                                                   dateEnd, dataDirectory,
+                                                   powerQuality.columnNames):
+        analyzer.add(data[(seconds >= startEpoch) & (seconds < endEpoch)])
+    return analyzer.finish()
+
+def analyzePowerQuality(dateStart = dateRangeStart, dateEnd = dateRangeEnd,
+                        dataDirectory = 'data/', processes = 1,
+                        eventFileName = None, summaryFileName = None):
+    '''
+    sags, swells, frequency excursions and low power factor periods of
+    the mains from dateStart up to dateEnd, and summary statistics for
+    each hour.  each month is analyzed separately, on a process pool if
+    processes is more than 1, and the months are joined.  returns
+    (events, summary) as described in powerQuality and writes them to
+    csv files if file names are given
+    '''
+    limits = dict(powerQualityLimits)
+    cellList = [(monthStart, monthEnd, dataDirectory, limits)
+                for monthStart, monthEnd in getMonthRanges(dateStart, dateEnd)]
+    resultList = mapCells(getPowerQualityCell, cellList, processes)
+    events, summary, span = powerQuality.mergeResults(
+        resultList, limits.get('maxGap', 60))
+    if eventFileName is not None:
+        powerQuality.writeEventCSV(eventFileName, events)
+    if summaryFileName is not None:
+        powerQuality.writeSummaryCSV(summaryFileName, summary)
+    return events, summary
 
 # plotting functions
 # ------------------
@@ -461,13 +1070,50 @@ def usageBarGraph():
     #plt.show()
     plt.savefig('pelenganaConsumption.pdf')
 
-def plotLoadDurationCurve():
+def plotLoadDurationCurve(dateStart = dateRangeStart,
+                          dateEnd = dateRangeEnd,
+                          dataDirectory = 'data/',
+                          fileName = 'loadDuration.pdf'):
     '''
     takes data from start to end dates, tabulates power usage, and generates
-    a load duration curve that orders hours vs power
+    a load duration curve that orders hours vs power.  the system load
+    of an hour is the mean watts summed over the consumer circuits (not
+    the mains), read from the hourly rollup a month at a time into a
+    histogram, so years of data never have to be held at once
     '''
-    # open hourly usage csv file
+    # open hourly usage rollup
+    rollup = getHourlyRollup(dateStart, dateEnd, dataDirectory)
+    circuitIndex = [i for i, c in enumerate(rollup.circuitList) if c != '200']
+    histogram = powerHistogram.linearHistogram(histogramMaxWatts,
+                                               histogramBinWidth)
     # loop through and calculate overall system usage for each hour
+    for monthStart, monthEnd in getMonthRanges(dateStart, dateEnd):
+        meanWatts = rollup.getQuantity('meanWatts', monthStart, monthEnd)[:, circuitIndex]
+        count = rollup.getQuantity('count', monthStart, monthEnd)[:, circuitIndex]
+        # skip hours with no samples at all rather than counting them as 0 W
+        hasData = (count > 0).any(axis=1)
+        histogram.add(np.nansum(meanWatts[hasData], axis=1))
     # sort usage by magnitude
+    power, hours = histogram.durationCurve()
     # plot
-    pass
\ No newline at end of file
+    fig, axis = getFigure()
+    axis.step(hours, power, where='post')
+    axis.set_xlabel('Hours at or Above Load')
+    axis.set_ylabel('System Load (Watts)')
+    axis.set_title('Load Duration Curve')
+    fig.savefig(fileName)
+    return histogram
+
+def plotPowerHistogram(histogram, circuit, fileName = None):
+    '''
+    plot a PowerHistogram of a circuit's watts, from getPowerHistograms
+    '''
+    if fileName is None:
+        fileName = 'powerHistogram_' + circuit + '.pdf'
+    fig, axis = getFigure()
+    axis.bar(histogram.binEdges[:-1], histogram.counts,
+             width=np.diff(histogram.binEdges), align='edge')
+    axis.set_xlabel('Power (Watts)')
+    axis.set_ylabel('Samples')
+    axis.set_title('Power Distribution of Circuit ' + circuit)
+    fig.savefig(fileName)
@@ -0,0 +1,78 @@
+'''
+fast parsing of the fixed format YYYYMMDDHHMMSS time stamps that start
+every line of the sheeva sd card logs
+
+the general purpose dateutil parser is most of the run time on month
+long ranges, so these functions only handle the 14 digit format
+'''
+
+import calendar
+import datetime
+import numpy as np
+
+
+def parseTimeStamp(timeStamp):
+    '''
+    given a 14 character YYYYMMDDHHMMSS string return a datetime object
+    '''
+    return datetime.datetime(int(timeStamp[0:4]),
+                             int(timeStamp[4:6]),
+                             int(timeStamp[6:8]),
+                             int(timeStamp[8:10]),
+                             int(timeStamp[10:12]),
+                             int(timeStamp[12:14]))
+
+def timeStampToEpoch(timeStamp):
+    '''
+    given a 14 character YYYYMMDDHHMMSS string return integer seconds
+    since 1970-01-01 00:00:00
+    '''
+    return calendar.timegm((int(timeStamp[0:4]),
+                            int(timeStamp[4:6]),
+                            int(timeStamp[6:8]),
+                            int(timeStamp[8:10]),
+                            int(timeStamp[10:12]),
+                            int(timeStamp[12:14]),
+                            0, 0, 0))
+
+def datetimeToEpoch(date):
+    '''
+    given a datetime object return integer seconds since 1970-01-01
+    '''
+    return calendar.timegm(date.timetuple())
+
+def timeStampArrayToDatetime64(timeStamps):
+    '''
+    given an array (or list) of YYYYMMDDHHMMSS strings, such as the
+    'Time Stamp' column of a record array from getFormattedData, return
+    a numpy datetime64[s] array without parsing each string in python
+    '''
+    timeStamps = np.ascontiguousarray(timeStamps, dtype='S14')
+    if timeStamps.size == 0:
+        return np.zeros(timeStamps.shape, dtype='datetime64[s]')
+    # view the characters as a (n, 14) array of digits
+    digits = timeStamps.reshape(-1).view(np.uint8).reshape(-1, 14)
+    digits = digits.astype(np.int64) - ord('0')
+    if (digits < 0).any() or (digits > 9).any():
+        raise ValueError('time stamps must be 14 digit YYYYMMDDHHMMSS strings')
+    year   = (digits[:, 0] * 1000 + digits[:, 1] * 100 +
+              digits[:, 2] * 10 + digits[:, 3])
+    month  = digits[:, 4] * 10 + digits[:, 5]
+    day    = digits[:, 6] * 10 + digits[:, 7]
+    hour   = digits[:, 8] * 10 + digits[:, 9]
+    minute = digits[:, 10] * 10 + digits[:, 11]
+    second = digits[:, 12] * 10 + digits[:, 13]
+    # build dates from calendar months so month lengths and leap years
+    # are handled by numpy
+    dates = ((year - 1970) * 12 + (month - 1)).astype('datetime64[M]')
+    dates = dates.astype('datetime64[D]') + (day - 1).astype('timedelta64[D]')
+    dates = dates.astype('datetime64[s]')
+    dates = dates + (hour * 3600 + minute * 60 + second).astype('timedelta64[s]')
+    return dates.reshape(timeStamps.shape)
+
+def timeStampArrayToEpoch(timeStamps):
+    '''
+    given an array (or list) of YYYYMMDDHHMMSS strings return an int64
+    array of seconds since 1970-01-01 00:00:00
+    '''
+    return timeStampArrayToDatetime64(timeStamps).astype(np.int64)
@@ -1,18 +1,46 @@
+'''
+merges the per circuit sd card logs into one wide table with a row for
+every time stamp at which any circuit reported
+
+run as a script it writes the range dateRangeStart to dateRangeEnd to a
+time stamped csv file or column store.  imported, iter_merged_rows gives
+the merged rows as a generator
+
+    import writeHugeCSV
+    for timeStamp, fields in writeHugeCSV.iter_merged_rows(start, end,
+                                                           ['200', '201'],
+                                                           ['Watts']):
+        ...
+'''
+
 import datetime
+import heapq
+import json
+import multiprocessing
 import os
-import dateutil.parser
+import shutil
+import tempfile
+import numpy as np
+import blockWriter
+import columnStore
+import logManifest
+import logReader
+import prefetch
+import timeStamps
 
 
-def constructPath(currentDatetime):
+def constructPath(currentDatetime, directory=None):
     '''
-    given a datetime object, this function creates a path name that 
+    given a datetime object, this function creates a path name that
     matches the sheeva file directory structure for data logs
     '''
+    if directory is None:
+        directory = dataDirectory
     path = '%02d/%02d/%02d/%02d/' % (currentDatetime.year,
                                      currentDatetime.month,
                                      currentDatetime.day,
                                      currentDatetime.hour)
-    path = dataDirectory + path
+    path = directory + path
     return path
 
 def constructCircuitList():
@@ -27,6 +55,16 @@ def constructCircuitList():
         fileCircuitList.append('192_168_1_' + circuit + '.log')
     return fileCircuitList
 
+def getCircuitFileName(circuit):
+    '''
+    returns the log file name for a circuit given as a number such as
+    '201' or 201, or as a file name already
+    '''
+    circuit = str(circuit)
+    if circuit.endswith('.log'):
+        return circuit
+    return '192_168_1_' + circuit + '.log'
+
 def openFiles(path, fileCircuitList):
     '''
     attempts to open every circuit's log file in 'path' and returns
@@ -39,16 +77,65 @@ def openFiles(path, fileCircuitList):
         if os.path.isfile(file):
             fileDict[circuit] = open(file, 'r')
     return fileDict
-    
-def getNewFiles(timeStamp, fileCircuitList):
+
+def getNewFiles(timeStamp, fileCircuitList, directory=None, manifest=None,
+                rangeStart=None, rangeEnd=None):
     '''
-    helper function to open new log files 
+    helper function to open new log files.  with a logManifest only the
+    files it lists, and that overlap rangeStart to rangeEnd, are opened
     '''
-    path = constructPath(timeStamp)       
-    fileDict = openFiles(path, fileCircuitList)
+    path = constructPath(timeStamp, directory)
+    if manifest is None:
+        return openFiles(path, fileCircuitList)
+    fileDict = {}
+    for circuit in manifest.getFiles(timeStamp, fileCircuitList,
+                                     rangeStart, rangeEnd):
+        fileDict[circuit] = open(path + circuit, 'r')
     return fileDict
 
-def initializeLineDict():
+def getHourCircuitList(hour, fileCircuitList, directory=None, manifest=None,
+                       rangeStart=None, rangeEnd=None, checkFiles=True):
+    '''
+    circuit files of one hour to read, from the manifest or else by
+    checking which exist, or all of fileCircuitList if checkFiles is
+    False
+    '''
+    if manifest is not None:
+        return manifest.getFiles(hour, fileCircuitList, rangeStart, rangeEnd)
+    if not checkFiles:
+        return list(fileCircuitList)
+    path = constructPath(hour, directory)
+    return [circuit for circuit in fileCircuitList
+            if os.path.isfile(path + circuit)]
+
+def getNewReaders(hour, fileCircuitList, directory=None, manifest=None,
+                  rangeStart=None, rangeEnd=None, prefetcher=None):
+    '''
+    returns a dictionary of circuit file names to logReader.HourlyLogReader
+    objects for the log files of one hour, see getNewFiles.  with a
+    prefetch.FilePrefetcher the files are taken from it instead of being
+    opened here
+    '''
+    path = constructPath(hour, directory)
+    circuitList = getHourCircuitList(hour, fileCircuitList, directory,
+                                     manifest, rangeStart, rangeEnd,
+                                     prefetcher is None)
+    readerDict = {}
+    try:
+        for circuit in circuitList:
+            if prefetcher is None:
+                readerDict[circuit] = logReader.HourlyLogReader(path + circuit)
+                continue
+            content = prefetcher.get(path + circuit)
+            if content is not None:
+                readerDict[circuit] = logReader.HourlyLogReader(path + circuit,
+                                                                content)
+    except:
+        closeFiles(readerDict)
+        raise
+    return readerDict
+
+def initializeLineDict(fileDict):
     lineDict = {}
     # discard header line
     for key in fileDict.keys():
@@ -58,109 +145,868 @@ def initializeLineDict():
     for key in fileDict.keys():
         line = fileDict[key].readline()
         lineDict[key] = line
-    # print out dict
     return lineDict
 
 def initializeTimeStampDict(lineDict):
     timeStampDict = {}
     for key in lineDict.keys():
-        timeStampDict[key] = getTimeStampFromLine(lineDict[key])
+        # files with only a header have no time stamp
+        if len(lineDict[key]) >= 14:
+            timeStampDict[key] = getTimeStampFromLine(lineDict[key])
     return timeStampDict
 
 def getTimeStampFromLine(line):
-    lineTimeStamp = dateutil.parser.parse(line[0:14])
+    lineTimeStamp = timeStamps.parseTimeStamp(line[0:14])
     return lineTimeStamp
 
-def getNextUniqueTimeStampFromFile(key, timeStamp, file):
+def getNextUniqueTimeStampFromFile(key, timeStamp, fileDict, lineDict,
+                                   timeStampDict):
     while 1:
         # read next line in file
         lineDict[key] = fileDict[key].readline()
+        # if we encounter the end of the file, remove dict entry
+        if len(lineDict[key]) < 14:
+            del timeStampDict[key]
+            break
         # read next time stamp
         newTimeStamp = getTimeStampFromLine(lineDict[key])
         if newTimeStamp > timeStamp:
             timeStampDict[key] = newTimeStamp
             break
-        # if we encounter last file, remove dict entry
     return
 
-def writeCircuitData(circuit):
-    data = lineDict[circuit]
-    data = data.strip()
-    data = data.split(',')
-    if circuit == '192_168_1_200.log':
-        columnList = mainsColumnList
+def closeFiles(fileDict):
+    for key in fileDict.keys():
+        fileDict[key].close()
+
+def mergeHourHeap(readerDict, rangeStart, rangeEnd):
+    '''
+    k-way merge of one hour of circuit log readers.  a heap keyed on each
+    circuit's next time stamp hands out samples in time order, and a
+    (timeStamp, rowLines) pair is yielded for every distinct time stamp
+    seen in any file, so the work done depends on the number of samples
+    rather than seconds.  each reader's unique samples are found by
+    binary search from rangeStart to rangeEnd, which must lie within the
+    readers' hour so samples a log holds from the next hour are dropped
+    as the clock scan drops them, and the readers are closed when the
+    hour is done
+    '''
+    try:
+        startEpoch = timeStamps.datetimeToEpoch(rangeStart)
+        endEpoch = timeStamps.datetimeToEpoch(rangeEnd)
+        heap = []
+        readers = {}
+        for circuit in readerDict.keys():
+            readers[circuit] = readerDict[circuit].iterUniqueSamples(startEpoch,
+                                                                     endEpoch)
+            sample = next(readers[circuit], None)
+            if sample is not None:
+                heapq.heappush(heap, (sample[0], circuit, sample[1]))
+        while heap:
+            timeStamp = heap[0][0]
+            rowLines = {}
+            # pop every circuit that reported at this time stamp
+            while heap and heap[0][0] == timeStamp:
+                sampleTimeStamp, circuit, line = heapq.heappop(heap)
+                rowLines[circuit] = line
+                sample = next(readers[circuit], None)
+                if sample is not None:
+                    heapq.heappush(heap, (sample[0], circuit, sample[1]))
+            yield datetime.datetime.utcfromtimestamp(timeStamp), rowLines
+    finally:
+        closeFiles(readerDict)
+
+def iterHeapRows(fileCircuitList, rangeStart, rangeEnd, directory=None,
+                 verbose=0, manifest=None, prefetchHours=0):
+    '''
+    event driven merge from rangeStart to rangeEnd, one hour directory
+    at a time, yielding (timeStamp, rowLines) pairs.  with a logManifest
+    hours without files for these circuits are skipped.  with
+    prefetchHours the files of that many upcoming hours are read in
+    background threads while the current hour is merged
+    '''
+    if manifest is not None:
+        hourList = manifest.getHours(rangeStart, rangeEnd, fileCircuitList)
     else:
-        columnList = circuitsColumnList
-    for col in columnList:
-        csv.write(data[col]+',')
+        hourList = []
+        hour = rangeStart.replace(minute=0, second=0, microsecond=0)
+        while hour < rangeEnd:
+            hourList.append(hour)
+            hour = hour + datetime.timedelta(hours=1)
+    prefetcher = None
+    if prefetchHours > 0:
+        fileNameList = []
+        for hour in hourList:
+            path = constructPath(hour, directory)
+            for circuit in getHourCircuitList(hour, fileCircuitList, directory,
+                                              manifest, rangeStart, rangeEnd,
+                                              False):
+                fileNameList.append(path + circuit)
+        prefetcher = prefetch.FilePrefetcher(
+            fileNameList, ahead=prefetchHours * len(fileCircuitList))
+    try:
+        for hour in hourList:
+            if verbose >= 1:
+                print hour
+            readerDict = getNewReaders(hour, fileCircuitList, directory,
+                                       manifest, rangeStart, rangeEnd,
+                                       prefetcher)
+            # only this hour's samples, so rows stay in time order when a
+            # log runs on past the end of its hour
+            hourStart = max(rangeStart, hour)
+            hourEnd = min(rangeEnd, hour + datetime.timedelta(hours=1))
+            for row in mergeHourHeap(readerDict, hourStart, hourEnd):
+                yield row
+    finally:
+        # stop reading ahead when the range ends or the caller stops early
+        if prefetcher is not None:
+            prefetcher.close()
+
+def iterClockRows(fileCircuitList, rangeStart, rangeEnd, directory=None,
+                  verbose=0, manifest=None):
+    '''
+    original merge that steps through every second from rangeStart to
+    rangeEnd and checks each open file for a sample at that second,
+    yielding (timeStamp, rowLines) pairs
+    '''
+    timeStamp = rangeStart
+    fileDict = getNewFiles(timeStamp, fileCircuitList, directory, manifest)
+    try:
+        lineDict = initializeLineDict(fileDict)
+        timeStampDict = initializeTimeStampDict(lineDict)
+
+        # iterate by second from dateRangeStart to dateRange end
+        while timeStamp != rangeEnd:
+            # if sample exists in any file, collect its line
+            if timeStamp in timeStampDict.values():
+                rowLines = {}
+                # loop through all circuits looking for data at this timestamp
+                for circuit in fileCircuitList:
+                    # if circuit has open file and
+                    # timestamp matches, keep circuit information
+                    if timeStampDict.get(circuit) == timeStamp:
+                        rowLines[circuit] = lineDict[circuit]
+                        getNextUniqueTimeStampFromFile(circuit, timeStamp,
+                                                       fileDict, lineDict,
+                                                       timeStampDict)
+                yield timeStamp, rowLines
+
+            # increment timestamp and deal with hour change if necessary
+            oldtimeStamp = timeStamp
+            timeStamp = timeStamp + datetime.timedelta(seconds=1)
+            if oldtimeStamp.hour != timeStamp.hour:
+                if verbose >= 1:
+                    print timeStamp
+                closeFiles(fileDict)
+                fileDict = getNewFiles(timeStamp, fileCircuitList, directory, manifest)
+                lineDict = initializeLineDict(fileDict)
+                timeStampDict = initializeTimeStampDict(lineDict)
+    finally:
+        closeFiles(fileDict)
 
-def writeCircuitNoData(circuit):
-    if circuit == '192_168_1_200.log':
-        csv.write(',' * len(mainsColumnList))
+def compareMergeModes(start, end, circuits=None, directory=None,
+                      manifest=None):
+    '''
+    check that heap and clock modes merge the logs from start up to end
+    into the same rows.  returns None if they agree, or the first pair
+    of rows that differ, with None for a missing row.  start should be
+    on the hour, as the clock scan loses the first hour of a log whose
+    samples begin before start
+    '''
+    heapRows = iter_merged_rows(start, end, circuits, directory=directory,
+                                mode='heap', manifest=manifest)
+    clockRows = iter_merged_rows(start, end, circuits, directory=directory,
+                                 mode='clock', manifest=manifest)
+    while True:
+        heapRow = next(heapRows, None)
+        clockRow = next(clockRows, None)
+        if heapRow != clockRow:
+            return heapRow, clockRow
+        if heapRow is None:
+            return None
+
+def iter_merged_rows(start, end, circuits=None, columns=None,
+                     directory=None, mode='heap', verbose=0, manifest=None,
+                     bucketSeconds=None, prefetchHours=0):
+    '''
+    generator over the merged sd card logs from start up to end.  yields
+    (timeStamp, fields) for every time stamp at which any circuit has a
+    sample.  fields is a list aligned with circuits holding None for a
+    circuit without a sample at timeStamp and otherwise the list of its
+    requested column strings
+
+    circuits are circuit numbers such as '201' or log file names and
+    default to 200 through 212.  columns are log column names such as
+    'Watts' or column indices and default to the columns written by the
+    script.  only one hour of files is open at a time and all state is
+    local, so several merges can run side by side in one process.  a
+    logManifest of the directory avoids checking for missing files
+
+    with bucketSeconds, one row is yielded per time bucket instead, see
+    iterBucketRows.  prefetchHours reads upcoming hours in the background
+    in heap mode, see iterHeapRows
+    '''
+    if circuits is None:
+        fileCircuitList = constructCircuitList()
     else:
-        csv.write(',' * len(circuitsColumnList))
-
-def printHeader():
-    csv.write('date,')
-    circuit = '200'
-    for col in ['watts','volts','amps','watt hours SC20','watt hours today']:
-        csv.write(circuit+'_'+col+',')
-    circuitList = range(201,213)
-    circuitList = map(str, circuitList)
-    for circuit in circuitList:
-        for col in ['watts','volts','amps','watt hours SC20','watt hours today','credit']:
-            csv.write(circuit+'_'+col+',')
+        fileCircuitList = [getCircuitFileName(circuit) for circuit in circuits]
+    columnLists = [getColumnList(circuit, columns) for circuit in fileCircuitList]
+    if mode == 'heap':
+        rows = iterHeapRows(fileCircuitList, start, end, directory, verbose,
+                            manifest, prefetchHours)
+    elif mode == 'clock':
+        rows = iterClockRows(fileCircuitList, start, end, directory, verbose,
+                             manifest)
+    else:
+        raise ValueError('mode must be heap or clock, not %r' % mode)
+    rows = iterFieldRows(rows, fileCircuitList, columnLists)
+    if bucketSeconds is not None:
+        rows = iterBucketRows(rows, bucketSeconds, columnLists)
+    for row in rows:
+        yield row
+
+def iterFieldRows(rows, fileCircuitList, columnLists):
+    '''
+    turn (timeStamp, rowLines) pairs into (timeStamp, fields) rows
+    holding the strings of the columns in columnLists for each circuit
+    '''
+    for timeStamp, rowLines in rows:
+        fields = []
+        for circuit, columnList in zip(fileCircuitList, columnLists):
+            line = rowLines.get(circuit)
+            if line is None:
+                fields.append(None)
+            else:
+                data = line.strip().split(',')
+                # the mains log has no credit column
+                fields.append([data[col] if col < len(data) else ''
+                               for col in columnList])
+        yield timeStamp, fields
+
+def iterBucketRows(rows, bucketSeconds, columnLists):
+    '''
+    aggregate (timeStamp, fields) rows into buckets of bucketSeconds
+    aligned on multiples of bucketSeconds since the epoch (so 60, 900 or
+    3600 second buckets start on the minute or hour).  yields one
+    (bucketStart, fields) row per bucket with samples, where each
+    circuit's fields hold mean, min, max and count for instantaneous
+    columns such as watts, and the last value for the watt hour counters
+    and credit (see isLastValueColumn)
+    '''
+    lastFlagLists = [[isLastValueColumn(col) for col in columnList]
+                     for columnList in columnLists]
+    bucketStart = None
+    accumulators = None
+    for timeStamp, fields in rows:
+        epoch = timeStamps.datetimeToEpoch(timeStamp)
+        start = epoch - epoch % bucketSeconds
+        if start != bucketStart:
+            if bucketStart is not None:
+                yield formatBucket(bucketStart, accumulators, lastFlagLists)
+            bucketStart = start
+            accumulators = [None] * len(fields)
+        for i, circuitFields in enumerate(fields):
+            if circuitFields is None:
+                continue
+            if accumulators[i] is None:
+                accumulators[i] = [None] * len(circuitFields)
+            accumulateFields(accumulators[i], circuitFields, lastFlagLists[i])
+    if bucketStart is not None:
+        yield formatBucket(bucketStart, accumulators, lastFlagLists)
+
+def accumulateFields(accumulator, circuitFields, lastFlagList):
+    '''
+    add one circuit sample to its bucket accumulator, which holds the
+    last string for last value columns and [sum, count, min, max, min
+    string, max string] for the others
+    '''
+    for k, field in enumerate(circuitFields):
+        if not field:
+            continue
+        if lastFlagList[k]:
+            accumulator[k] = field
+            continue
+        value = float(field)
+        stats = accumulator[k]
+        if stats is None:
+            accumulator[k] = [value, 1, value, value, field, field]
+            continue
+        stats[0] += value
+        stats[1] += 1
+        if value < stats[2]:
+            stats[2] = value
+            stats[4] = field
+        if value > stats[3]:
+            stats[3] = value
+            stats[5] = field
+
+def formatBucket(bucketStart, accumulators, lastFlagLists):
+    fields = []
+    for accumulator, lastFlagList in zip(accumulators, lastFlagLists):
+        if accumulator is None:
+            fields.append(None)
+            continue
+        circuitFields = []
+        for stats, isLast in zip(accumulator, lastFlagList):
+            if isLast:
+                circuitFields.append(stats or '')
+            elif stats is None:
+                circuitFields.extend(['', '', '', '0'])
+            else:
+                circuitFields.extend(['%.10g' % (stats[0] / stats[1]),
+                                      stats[4], stats[5], str(stats[1])])
+        fields.append(circuitFields)
+    return datetime.datetime.utcfromtimestamp(bucketStart), fields
+
+def isLastValueColumn(col):
+    '''
+    True for log columns aggregated by their last value in a bucket,
+    the watt hour counters and credit
+    '''
+    return logColumnNameList[col] in lastValueColumnNameList
+
+def getOutputWidthList(fileCircuitList, columns=None, bucketSeconds=None):
+    '''
+    number of output columns for each circuit
+    '''
+    return [len(getOutputColumnNameList(circuit, columns, bucketSeconds))
+            for circuit in fileCircuitList]
+
+def getOutputColumnNameList(circuit, columns=None, bucketSeconds=None):
+    '''
+    output column names for one circuit, such as 'watts mean', 'watts
+    min', 'watts max', 'watts count' for a watts column when bucketed
+    '''
+    nameList = getColumnNameList(circuit, columns)
+    if bucketSeconds is None:
+        return nameList
+    outputNameList = []
+    for col, name in zip(getColumnList(circuit, columns), nameList):
+        if isLastValueColumn(col):
+            outputNameList.append(name + ' last')
+        else:
+            for statistic in ['mean', 'min', 'max', 'count']:
+                outputNameList.append(name + ' ' + statistic)
+    return outputNameList
+
+def getColumnList(circuit, columns=None):
+    '''
+    log file column indices for a circuit's file name given a list of
+    column names or indices, or the script's default columns
+    '''
+    if columns is None:
+        if circuit == '192_168_1_200.log':
+            return mainsColumnList
+        else:
+            return circuitsColumnList
+    columnList = []
+    for col in columns:
+        if isinstance(col, int):
+            columnList.append(col)
+        else:
+            columnList.append(logColumnNameList.index(col))
+    return columnList
+
+def getColumnNameList(circuit, columns=None):
+    if columns is None:
+        if circuit == '192_168_1_200.log':
+            return mainsColumnNameList
+        else:
+            return circuitsColumnNameList
+    return [logColumnNameList[col] for col in getColumnList(circuit, columns)]
+
+def constructColumnNames(fileCircuitList, columns=None, bucketSeconds=None):
+    '''
+    output column names such as '201_watts', in output order, not
+    including the date column
+    '''
+    columnNames = []
+    for circuit in fileCircuitList:
+        number = circuit.split('_')[-1].split('.')[0]
+        for col in getOutputColumnNameList(circuit, columns, bucketSeconds):
+            columnNames.append(number + '_' + col)
+    return columnNames
+
+def openOutput(name, fileCircuitList, columns=None, outputFormat='csv',
+               append=False, size=None, bucketSeconds=None, rows=None):
+    '''
+    open a csv writer or column store writer for the merged table and
+    write the csv header.  with append, rows are added to an existing
+    output, which is first cut back to 'size' bytes for a csv file or to
+    'rows' rows for a column store, to drop anything written after the
+    resume point of its checkpoint
+    '''
+    if outputFormat == 'columns':
+        return columnStore.ColumnStoreWriter(
+            name, constructColumnNames(fileCircuitList, columns, bucketSeconds),
+            append, rows)
+    if append:
+        if size is not None:
+            file = open(name, 'r+b')
+            file.truncate(size)
+            file.close()
+        return blockWriter.BlockWriter(blockWriter.openOutput(name, True))
+    output = blockWriter.BlockWriter(blockWriter.openOutput(name))
+    printHeader(output, fileCircuitList, columns, bucketSeconds)
+    return output
+
+def writeRows(output, rows, fileCircuitList, columns=None,
+              outputFormat='csv', blockRows=4096, bucketSeconds=None,
+              holdTail=False):
+    '''
+    write (timeStamp, fields) rows from iter_merged_rows to an output in
+    blocks of about blockRows rows.  returns the last time stamp written,
+    or None if there were no rows, and the tail, the rows from the
+    resume point of the last row on (see getResumeStart).  with
+    holdTail the tail is returned without being written, so the caller
+    can record the output length before it
+    '''
+    widthList = getOutputWidthList(fileCircuitList, columns, bucketSeconds)
+    lastTimeStamp = None
+    block = []
+    tail = []
+    tailStart = None
+    for row in rows:
+        resumeStart = getResumeStart(row[0], bucketSeconds)
+        if resumeStart != tailStart:
+            block.extend(tail)
+            tail = []
+            tailStart = resumeStart
+            if len(block) >= blockRows:
+                writeBlock(output, block, widthList, outputFormat)
+                block = []
+        tail.append(row)
+        lastTimeStamp = row[0]
+    writeBlock(output, block, widthList, outputFormat)
+    if not holdTail:
+        writeBlock(output, tail, widthList, outputFormat)
+    return lastTimeStamp, tail
+
+def getResumeStart(timeStamp, bucketSeconds=None):
+    '''
+    where an append to an output ending with the row at timeStamp starts
+    merging again: the start of the last merged hour, as circuits whose
+    logs were behind when it was merged may since have added samples to
+    it, moved back to the start of its bucket for bucketed output, as
+    the last bucket may have been cut short
+    '''
+    epoch = timeStamps.datetimeToEpoch(timeStamp)
+    epoch -= epoch % 3600
+    if bucketSeconds is not None:
+        epoch -= epoch % bucketSeconds
+    return datetime.datetime.utcfromtimestamp(epoch)
+
+def isResumable(outputName, outputFormat='csv'):
+    '''
+    True if an output can be cut back to a resume point and appended to.
+    bz2 files cannot, see blockWriter.openOutput, and are written as one
+    stream with no resume point
+    '''
+    return outputFormat == 'columns' or not outputName.endswith('.bz2')
+
+def getOutputLength(outputName, outputFormat='csv'):
+    '''
+    (size in bytes, rows) of a closed output, with only the size of a
+    csv file and the rows of a column store known
+    '''
+    if outputFormat == 'columns':
+        return None, columnStore.readMetadata(outputName)['rows']
+    return os.path.getsize(outputName), None
+
+def writeBlock(output, block, widthList, outputFormat='csv'):
+    '''
+    write a list of (timeStamp, fields) merged rows to the output in the
+    format selected by outputFormat
+    '''
+    if not block:
+        return
+    if outputFormat == 'columns':
+        times, values = constructColumnBlock(block, widthList)
+        output.appendRows(times, values)
+    else:
+        output.writeRows([formatRow(timeStamp, fields, widthList)
+                          for timeStamp, fields in block])
+
+def constructColumnBlock(block, widthList):
+    '''
+    convert a list of (timeStamp, fields) merged rows into an int64
+    array of epoch seconds and a float32 (column, row) array of values
+    with nan where a circuit has no sample
+    '''
+    times = np.array([timeStamps.datetimeToEpoch(timeStamp)
+                      for timeStamp, fields in block], dtype=np.int64)
+    values = np.empty((sum(widthList), len(block)), dtype=np.float32)
+    values.fill(np.nan)
+    offsetList = np.cumsum([0] + widthList)
+    for j, (timeStamp, fields) in enumerate(block):
+        for offset, circuitFields in zip(offsetList, fields):
+            if circuitFields is None:
+                continue
+            for k, field in enumerate(circuitFields):
+                if field:
+                    values[offset + k, j] = float(field)
+    return times, values
+
+def formatRow(timeStamp, fields, widthList):
+    '''
+    format one merged row, leaving blank columns for circuits without a
+    sample at timeStamp
+    '''
+    row = [str(timeStamp), ',']
+    for width, circuitFields in zip(widthList, fields):
+        if circuitFields is None:
+            row.append(',' * width)
+        else:
+            row.append(','.join(circuitFields) + ',')
+    row.append('\n')
+    return ''.join(row)
+
+def printHeader(output, fileCircuitList, columns=None, bucketSeconds=None):
+    output.write('date,')
+    for columnName in constructColumnNames(fileCircuitList, columns,
+                                           bucketSeconds):
+        output.write(columnName+',')
+    output.write('\n')
+
+def constructShardList(rangeStart, rangeEnd, hours):
+    '''
+    split rangeStart to rangeEnd into consecutive (start, end) shards of
+    at most 'hours' hour directories each.  shards end on multiples of
+    'hours' hours since the epoch, so time buckets that divide the shard
+    length are never split between two shards
+    '''
+    shardSeconds = hours * 3600
+    endEpoch = timeStamps.datetimeToEpoch(rangeEnd)
+    shardList = []
+    shardStart = rangeStart
+    while shardStart < rangeEnd:
+        startEpoch = timeStamps.datetimeToEpoch(shardStart)
+        shardEpoch = min(startEpoch - startEpoch % shardSeconds + shardSeconds,
+                         endEpoch)
+        shardEnd = datetime.datetime.utcfromtimestamp(shardEpoch)
+        shardList.append((shardStart, shardEnd))
+        shardStart = shardEnd
+    return shardList
+
+def initShardWorker(settings):
+    '''
+    process pool initializer keeping the merge settings, with the
+    manifest, in the worker so they are sent once per worker rather
+    than with every shard
+    '''
+    global shardSettings
+    shardSettings = settings
+
+def mergeShard(shard):
+    '''
+    process pool worker that merges one (start, end, partFileName) shard
+    into its own headerless partial csv file or column store, with the
+    settings given to initShardWorker.  returns the part file name, the
+    last time stamp written and the tail rows held back from the part,
+    see writeRows
+    '''
+    shardStart, shardEnd, partFileName = shard
+    settings = shardSettings
+    fileCircuitList = settings['fileCircuitList']
+    columns = settings['columns']
+    outputFormat = settings['outputFormat']
+    bucketSeconds = settings['bucketSeconds']
+    if outputFormat == 'columns':
+        output = columnStore.ColumnStoreWriter(
+            partFileName,
+            constructColumnNames(fileCircuitList, columns, bucketSeconds))
+    else:
+        output = blockWriter.BlockWriter(open(partFileName, 'w'))
+    rows = iter_merged_rows(shardStart, shardEnd, fileCircuitList, columns,
+                            settings['directory'], settings['mode'],
+                            settings['verbose'], settings['manifest'],
+                            bucketSeconds, settings['prefetchHours'])
+    lastTimeStamp, tail = writeRows(output, rows, fileCircuitList, columns,
+                                    outputFormat, settings['blockRows'],
+                                    bucketSeconds, True)
+    output.close()
+    return partFileName, lastTimeStamp, tail
+
+def mergeParallel(output, rangeStart, rangeEnd, processes, hours,
+                  fileCircuitList, columns=None, directory=None, mode='heap',
+                  outputFormat='csv', blockRows=4096, verbose=0,
+                  manifest=None, bucketSeconds=None, prefetchHours=0):
+    '''
+    merge shards of hour directories in a process pool and append the
+    partial outputs to the open csv file or column store in time order.
+    returns the last time stamp written, or None if there were no rows,
+    and the tail rows of the last shard with rows, which are held back
+    as by writeRows.  time buckets must divide the shards so none is
+    split between workers
+    '''
+    if bucketSeconds is not None and (hours * 3600) % bucketSeconds != 0:
+        raise ValueError('bucketSeconds must divide the %d hour shards' % hours)
+    settings = {'fileCircuitList': fileCircuitList,
+                'columns': columns,
+                'directory': directory,
+                'mode': mode,
+                'outputFormat': outputFormat,
+                'blockRows': blockRows,
+                'verbose': verbose,
+                'manifest': manifest,
+                'bucketSeconds': bucketSeconds,
+                'prefetchHours': prefetchHours}
+    partDirectory = tempfile.mkdtemp(prefix='writeHugeCSV_')
+    try:
+        shardList = []
+        for i, (shardStart, shardEnd) in enumerate(
+                constructShardList(rangeStart, rangeEnd, hours)):
+            partFileName = os.path.join(partDirectory, 'part_%06d.csv' % i)
+            shardList.append((shardStart, shardEnd, partFileName))
+        # flush the header before workers fork so it is not written twice
+        output.flush()
+        pool = multiprocessing.Pool(processes, initShardWorker, (settings,))
+        try:
+            # map returns part files in shard order
+            partList = pool.map(mergeShard, shardList, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        widthList = getOutputWidthList(fileCircuitList, columns, bucketSeconds)
+        lastTimeStamp = None
+        tail = []
+        for partFileName, partLastTimeStamp, partTail in partList:
+            if partLastTimeStamp is None:
+                continue
+            lastTimeStamp = partLastTimeStamp
+            # the tail of the shard before goes ahead of this one
+            writeBlock(output, tail, widthList, outputFormat)
+            tail = partTail
+            if outputFormat == 'columns':
+                output.appendStore(partFileName)
+            else:
+                partFile = open(partFileName, 'r')
+                shutil.copyfileobj(partFile, output)
+                partFile.close()
+    finally:
+        shutil.rmtree(partDirectory)
+    return lastTimeStamp, tail
+
+def getCheckpointFileName(outputName):
+    return outputName.rstrip('/') + '.checkpoint'
+
+def saveCheckpoint(outputName, outputFormat, columnNames, rangeStart,
+                   lastTimeStamp, resumeTimeStamp, resumeSize=None,
+                   resumeRows=None, manifest=None, bucketSeconds=None):
+    '''
+    write a checkpoint next to a closed output recording the last merged
+    time stamp (the last bucket start for bucketed output), the resume
+    point an append merges again from with the output size or rows
+    before it, and, given a logManifest, the size and mtime of every log
+    file in the merged hours
+    '''
+    checkpoint = {'outputFormat': outputFormat,
+                  'columnNames': columnNames,
+                  'bucketSeconds': bucketSeconds,
+                  'rangeStart': rangeStart.strftime('%Y%m%d%H%M%S'),
+                  'lastTimeStamp': None,
+                  'resumeTimeStamp': None,
+                  'resumeSize': resumeSize,
+                  'resumeRows': resumeRows,
+                  'hours': {}}
+    if lastTimeStamp is not None:
+        checkpoint['lastTimeStamp'] = lastTimeStamp.strftime('%Y%m%d%H%M%S')
+        if resumeTimeStamp is not None:
+            checkpoint['resumeTimeStamp'] = resumeTimeStamp.strftime(
+                '%Y%m%d%H%M%S')
+        if manifest is not None:
+            checkpoint['hours'] = getMergedHourState(manifest, rangeStart,
+                                                     lastTimeStamp)
+    file = open(getCheckpointFileName(outputName) + '.tmp', 'w')
+    json.dump(checkpoint, file)
+    file.close()
+    os.rename(getCheckpointFileName(outputName) + '.tmp',
+              getCheckpointFileName(outputName))
+
+def loadCheckpoint(outputName):
+    file = open(getCheckpointFileName(outputName), 'r')
+    checkpoint = json.load(file)
+    file.close()
+    return checkpoint
+
+def getMergedHourState(manifest, rangeStart, lastTimeStamp):
+    '''
+    dictionary of hour key to {file name: [size, mtime]} for the hours
+    of the manifest from rangeStart through lastTimeStamp
+    '''
+    firstKey = logManifest.getHourKey(rangeStart)
+    lastKey = logManifest.getHourKey(lastTimeStamp)
+    hours = {}
+    for key, files in manifest.hourDict.items():
+        if firstKey <= key <= lastKey:
+            hours[key] = dict((name, list(info[0:2]))
+                              for name, info in files.items())
+    return hours
+
+def getChangedHours(checkpoint, manifest):
+    '''
+    sorted hour keys, before the resume point, whose log files were
+    added, removed or rewritten since the checkpoint.  their new samples
+    cannot be appended and need a full merge.  the hours from the resume
+    point on, at least the last merged hour, are left out as an append
+    merges them again, see getResumeStart
+    '''
+    if checkpoint['lastTimeStamp'] is None:
+        return []
+    rangeStart = timeStamps.parseTimeStamp(checkpoint['rangeStart'])
+    lastTimeStamp = timeStamps.parseTimeStamp(checkpoint['lastTimeStamp'])
+    resumeTimeStamp = timeStamps.parseTimeStamp(checkpoint['resumeTimeStamp'])
+    oldHours = checkpoint['hours']
+    newHours = getMergedHourState(manifest, rangeStart, lastTimeStamp)
+    resumeKey = logManifest.getHourKey(resumeTimeStamp)
+    changedHours = []
+    for key in sorted(set(oldHours.keys()) | set(newHours.keys())):
+        if key < resumeKey and oldHours.get(key) != newHours.get(key):
+            changedHours.append(key)
+    return changedHours
 
 
 dateRangeStart = datetime.datetime(2011, 1, 01, 0)
 dateRangeEnd   = datetime.datetime(2011, 2, 01, 0)
+# 'heap' merges on sample time stamps, 'clock' steps through every second
+mergeMode = 'heap'
+# number of worker processes, 1 merges serially in this process
+mergeProcesses = 1
+# hour directories handed to each worker at a time
+shardHours = 24
+# '.csv.gz', '.csv.bz2' or '.csv.xz' compress the output while writing,
+# though a '.csv.bz2' output cannot be appended to later
+csvExtension = '.csv'
+# merged rows formatted per block handed to the writer
+blockRows = 4096
+# 'csv' writes one wide csv file, 'columns' writes a columnStore directory
+outputFormat = 'csv'
+# use a cached logManifest of dataDirectory instead of checking every file
+useManifest = True
+# seconds per time bucket, e.g. 60 or 900, to write mean, min, max and
+# count per bucket instead of every sample, or None
+bucketSeconds = None
+# name of an earlier output to extend with samples newer than its
+# checkpoint, or None to write a new output from dateRangeStart
+appendOutputName = None
+# hours of log files read ahead in background threads while merging in
+# heap mode, 0 to read each file when its hour is merged
+prefetchHours = 0
+# merge settings of a pool worker, see initShardWorker
+shardSettings = None
 mainsColumnList = [1,2,3,4,5]
 circuitsColumnList = [1,2,3,4,5,20]
+mainsColumnNameList = ['watts','volts','amps','watt hours SC20','watt hours today']
+circuitsColumnNameList = mainsColumnNameList + ['credit']
+logColumnNameList = ['Time Stamp', 'Watts', 'Volts', 'Amps',
+                     'Watt Hours SC20', 'Watt Hours Today', 'Max Watts',
+                     'Max Volts', 'Max Amps', 'Min Watts', 'Min Volts',
+                     'Min Amps', 'Power Factor', 'Power Cycle', 'Frequency',
+                     'Volt Amps', 'Relay Not Closed', 'Send Rate',
+                     'Machine ID', 'Type', 'Credit']
+# counters and credit are summarized by their last value in a time bucket
+lastValueColumnNameList = ['Watt Hours SC20', 'Watt Hours Today', 'Credit']
 
 dataDirectory = '/Users/dsoto/Dropbox/metering_-_Berkley-CU/Mali/Shake down/SD Card logs/logs/'
-fileCircuitList = constructCircuitList()
-
-csvTimeStamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-csvFileName = csvTimeStamp + '.csv'
-csv = open(csvFileName, 'w')
-printHeader()
-            
-timeStamp = dateRangeStart
-fileDict = getNewFiles(timeStamp, fileCircuitList)
-lineDict = initializeLineDict()
-timeStampDict = initializeTimeStampDict(lineDict)
-    
-
-# iterate by second from dateRangeStart to dateRange end
-while timeStamp != dateRangeEnd:
-    # if sample exists in any file, write out timestamp
-    if timeStamp in timeStampDict.values():
-        csv.write(str(timeStamp)+',')
-        # loop through all circuits looking for data at this timestamp
-        for circuit in fileCircuitList:
-            # does circuit have open file?
-            if circuit in timeStampDict.keys():
-                # if circuit has open file and
-                # timestamp matches, write out circuit information
-                if timeStamp == timeStampDict[circuit]:
-                    writeCircuitData(circuit)
-                    getNextUniqueTimeStampFromFile(circuit, timeStamp, file)
-                # if circuit has open file and 
-                # if timestamp does not match, write out empty circuit
-                else:
-                    writeCircuitNoData(circuit)
-            # if circuit has no open file, write out empty circuit
-            else:
-                writeCircuitNoData(circuit)
-        csv.write('\n')
-
-    # increment timestamp and deal with hour change if necessary
-    oldtimeStamp = timeStamp
-    timeStamp = timeStamp + datetime.timedelta(seconds=1)
-    if oldtimeStamp.hour != timeStamp.hour:
-        print timeStamp
-        fileDict = getNewFiles(timeStamp, fileCircuitList)
-        lineDict = initializeLineDict()
-        timeStampDict = initializeTimeStampDict(lineDict)
 
-csv.close()
\ No newline at end of file
+if __name__ == '__main__':
+    fileCircuitList = constructCircuitList()
+    if useManifest:
+        manifest = logManifest.loadManifest(dataDirectory)
+    else:
+        manifest = None
+    if appendOutputName is not None:
+        outputName = appendOutputName
+        checkpoint = loadCheckpoint(outputName)
+        outputFormat = checkpoint['outputFormat']
+        bucketSeconds = checkpoint['bucketSeconds']
+    columnNames = constructColumnNames(fileCircuitList,
+                                       bucketSeconds=bucketSeconds)
+    if appendOutputName is not None:
+        if checkpoint['columnNames'] != columnNames:
+            raise ValueError('%s was written with different columns' % outputName)
+        if not isResumable(outputName, outputFormat):
+            raise ValueError('%s cannot be appended to' % outputName)
+        if manifest is not None:
+            for key in getChangedHours(checkpoint, manifest):
+                print 'warning: hour', key, 'changed after it was merged'
+        rangeStart = timeStamps.parseTimeStamp(checkpoint['rangeStart'])
+        lastTimeStamp = checkpoint['lastTimeStamp']
+        resumeTimeStamp = checkpoint['resumeTimeStamp']
+        resumeSize = checkpoint['resumeSize']
+        resumeRows = checkpoint['resumeRows']
+        if lastTimeStamp is not None:
+            lastTimeStamp = timeStamps.parseTimeStamp(lastTimeStamp)
+            # the rows from the resume point on are cut off and merged again
+            resumeTimeStamp = timeStamps.parseTimeStamp(resumeTimeStamp)
+            mergeStart = resumeTimeStamp
+        else:
+            mergeStart = rangeStart
+        output = openOutput(outputName, fileCircuitList,
+                            outputFormat=outputFormat, append=True,
+                            size=resumeSize, bucketSeconds=bucketSeconds,
+                            rows=resumeRows)
+    else:
+        csvTimeStamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+        if outputFormat == 'columns':
+            outputName = csvTimeStamp + '.columns'
+        else:
+            outputName = csvTimeStamp + csvExtension
+        rangeStart = dateRangeStart
+        lastTimeStamp = None
+        resumeTimeStamp = None
+        mergeStart = dateRangeStart
+        output = openOutput(outputName, fileCircuitList,
+                            outputFormat=outputFormat,
+                            bucketSeconds=bucketSeconds)
+
+    if mergeProcesses > 1:
+        newLastTimeStamp, tail = mergeParallel(output, mergeStart, dateRangeEnd,
+                                               mergeProcesses, shardHours,
+                                               fileCircuitList,
+                                               directory=dataDirectory,
+                                               mode=mergeMode,
+                                               outputFormat=outputFormat,
+                                               blockRows=blockRows, verbose=1,
+                                               manifest=manifest,
+                                               bucketSeconds=bucketSeconds,
+                                               prefetchHours=prefetchHours)
+    else:
+        rows = iter_merged_rows(mergeStart, dateRangeEnd, fileCircuitList,
+                                directory=dataDirectory, mode=mergeMode,
+                                verbose=1, manifest=manifest,
+                                bucketSeconds=bucketSeconds,
+                                prefetchHours=prefetchHours)
+        newLastTimeStamp, tail = writeRows(output, rows, fileCircuitList,
+                                           outputFormat=outputFormat,
+                                           blockRows=blockRows,
+                                           bucketSeconds=bucketSeconds,
+                                           holdTail=True)
+
+    resumable = isResumable(outputName, outputFormat)
+    if not resumable:
+        # keep a bz2 file in one stream, with the tail written straight on
+        writeRows(output, tail, fileCircuitList, outputFormat=outputFormat,
+                  bucketSeconds=bucketSeconds)
+    output.close()
+    if not resumable:
+        if newLastTimeStamp is not None:
+            lastTimeStamp = newLastTimeStamp
+        resumeSize, resumeRows = None, None
+    elif newLastTimeStamp is not None:
+        # note the output length before the tail, then write the tail
+        resumeSize, resumeRows = getOutputLength(outputName, outputFormat)
+        output = openOutput(outputName, fileCircuitList,
+                            outputFormat=outputFormat, append=True,
+                            bucketSeconds=bucketSeconds)
+        writeRows(output, tail, fileCircuitList, outputFormat=outputFormat,
+                  bucketSeconds=bucketSeconds)
+        output.close()
+        lastTimeStamp = newLastTimeStamp
+        resumeTimeStamp = getResumeStart(tail[0][0], bucketSeconds)
+    else:
+        # nothing from the resume point on, the output now ends there
+        resumeSize, resumeRows = getOutputLength(outputName, outputFormat)
+    saveCheckpoint(outputName, outputFormat, columnNames, rangeStart,
+                   lastTimeStamp, resumeTimeStamp, resumeSize, resumeRows,
+                   manifest, bucketSeconds)
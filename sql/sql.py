@@ -1,10 +1,17 @@
 import sqlalchemy
 import urllib
+import os
+import sys
 import numpy as np
 import matplotlib.dates
 import matplotlib.pyplot as plt
 import datetime as dt
 
+# the watt hour counter kernel is shared with the sd card scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'sdCard'))
+import counterEnergy
+
 from sqlalchemy import Column
 from sqlalchemy import Integer
 from sqlalchemy import DateTime
@@ -657,17 +664,23 @@ def inspectDayOfWatthours(circuit_id,
     print 'number of samples after duplicate removal = ', len(dates)
 
     data = np.array(data)
-    power = np.diff(data)
     dates = np.array(dates)
+    seconds = counterEnergy.datetimesToSeconds(dates)
 
-    # mask values with decrease in watthours and adjust for by one offset
-    decreaseMask = power < 0
-    np.insert(decreaseMask, 0, False)
+    # classify decreases in watthours, masks are offset by one so they
+    # pick the sample after each step
+    stepEnergy, resetMask, rollbackMask, high = \
+        counterEnergy.classifySteps(seconds, data)
+    decreaseMask = np.insert(resetMask | rollbackMask, 0, False)
 
     print 'decrease in watthours observed at these', sum(decreaseMask), 'times'
     print dates[decreaseMask]
+    print 'resets at', dates[np.insert(resetMask, 0, False)]
 
     print 'apparent power consumption for day using max = ', max(data)
+    edges = counterEnergy.datetimesToSeconds([day, day + dt.timedelta(days=1)])
+    print 'power consumption for day using counter = ', \
+        counterEnergy.counterEnergy(seconds, data, edges)[0]
 
     '''
     print power
@@ -762,7 +775,9 @@ readings are monotonic.
 input:
     circuit_id - circuit database id
     date - datetime object
-    method - 'max', 'midnight', 'eleven'
+    method - 'max', 'midnight', 'eleven', 'counter'
+             'counter' sums the counter steps from midnight with resets
+             and rollbacks handled by counterEnergy
 output:
     watthours for the day specified by date in input.  returns -1 on error
 TODO:
@@ -800,6 +815,15 @@ def getDailyEnergyForCircuit(circuit_id,
 
     if len(watthours) == 0:
         return -1
+    if method == 'counter':
+        if numReports <= reportThreshold:
+            return -1
+        # the counter starts the day at zero at midnight
+        seconds = counterEnergy.datetimesToSeconds([dateStart] + list(dates))
+        edges = counterEnergy.datetimesToSeconds([dateStart, dateEnd])
+        return counterEnergy.counterEnergy(seconds,
+                                           np.concatenate(([0], watthours)),
+                                           edges)[0]
     else:
         if method == 'max' and requireMonotonic and isMonotonic and numReports > reportThreshold:
             return np.max(watthours)